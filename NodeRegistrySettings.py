@@ -1,5 +1,7 @@
 
 
+import copy
+
 class NodeRegistrySettings(object):
 
 	"""docstring for NodeRegistrySettings"""
@@ -13,10 +15,73 @@ class NodeRegistrySettings(object):
 		# effect.
 		self.ACCUMULATE_RELATIONSHIPS = True
 
-		# If True, nodes acting as relations in a node relationship will be
-		# automatically associated with the right-hand nodes with the internal
-		# '_connects' relation. This enables the Graph.rel() method to work,
-		# but introduces considerable memory overhead as well that is avoided
-		# by disabling the setting. It is recommended that if the Graph.rel()
-		# is not needed that this setting be set to False.
-		self.MANAGE_CONNECTIONS = True
\ No newline at end of file
+		# If True, the nodes denoted by each relation in a node relationship
+		# are recorded in the registry's relation index (one entry per node
+		# and relation). This enables the Graph.rel() method to work; it is
+		# recommended that if Graph.rel() is not needed that this setting be
+		# set to False.
+		self.MANAGE_CONNECTIONS = True
+
+		# If True, the registry indexes the incoming edges of every node by
+		# relation, which enables reverse lookups with NodeList.relatedBy()
+		# and the backward half of bidirectional path searches. The default
+		# engine keeps a set of sources per node and relation, which costs
+		# about as much memory as the edges themselves; with COMPACT_STORAGE,
+		# the index is a reversed copy of each relation's arrays. Without it,
+		# relatedBy() and bidirectional searches without `reverse` relations
+		# raise an Exception. Snapshots always have it.
+		self.INDEX_INCOMING = False
+
+		# If True, graphs store their relationships with the CompactRegistry
+		# engine: node names are interned to integer IDs and each relation's
+		# edges are kept in typed arrays, which uses a fraction of the memory
+		# of the default engine for large graphs.
+		self.COMPACT_STORAGE = False
+
+		# Number of edges a relation may collect in the CompactRegistry's
+		# mutable delta buffer before they are merged into its arrays. Larger
+		# relations collect up to half as many edges as they hold, so that
+		# merging takes linear time overall.
+		self.COMPACT_DELTA_LIMIT = 65536
+
+		# Number of hops of the neighborhood of a node to load from the
+		# connected database along with the node. With a depth of k, a chain
+		# of k rel() calls is served by a single query.
+		self.LOAD_DEPTH = 0
+
+		# Maximum number of NodeList.rel() results kept in the registry's
+		# least recently used cache; 0 disables the cache. Cached results are
+		# invalidated whenever the relationships of their seed nodes change.
+		self.REL_CACHE_SIZE = 0
+
+		# If True, the graph may be shared between threads: reads (such as
+		# rel()) run concurrently, writes (relating, adding, loading and
+		# dumping) are serialized with a readers-writer lock, and every
+		# thread gets its own connection to the database, which is switched
+		# to WAL mode so that readers don't block the writer. Must be set
+		# before the Graph is created.
+		self.THREAD_SAFE = False
+
+		# Out-of-core mode: the maximum number of nodes loaded from the
+		# connected database to keep in memory; 0 means no limit. Beyond it,
+		# the least recently used loaded nodes have their relationships
+		# evicted from memory (pending changes are dumped first) and are
+		# marked as not loaded, so that they are loaded again when needed.
+		# Evicted Nodes themselves stay in the registry, since NodeLists may
+		# still refer to them. Evictions go down to 90% of the limit at once.
+		self.MAX_LOADED_NODES = 0
+
+		# If True, Graph.search() can find nodes by fuzzy matches of their
+		# names, using an index of the trigrams of every name. It is built in
+		# memory on the first fuzzy search, and kept in the NGRAMS table of
+		# the connected database, which is filled in when connecting and
+		# updated whenever nodes are written.
+		self.FUZZY_INDEX = False
+
+		# Maximum number of relatives NodeList.recommend() follows from any
+		# node, keeping the heaviest; 0 means no limit. Bounds the cost of
+		# ranking around high-degree hubs.
+		self.RANK_MAX_DEGREE = 1000
+
+	def copy(self):
+		return copy.copy(self)
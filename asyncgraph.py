@@ -0,0 +1,156 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from graph import *
+
+class AsyncGraph(object):
+
+	"""
+	asyncio facade over a Graph. Everything that may touch the database
+	(loading, dumping and reading source files) runs on a dedicated thread
+	pool, so it never blocks the event loop, and is awaited:
+
+		g = AsyncGraph()
+		g.connect('graph.db')
+		bob = await g.get('bob')
+		fof = await g.expand(await g.expand(bob,'friends'),'friends')
+
+	Loads are shared and coalesced: concurrent requests for a node that is
+	already being loaded wait for that load instead of starting another,
+	and all of the nodes requested during one iteration of the event loop
+	are loaded together, with a single query.
+
+	The Graph must be shared with the pool's threads, so it is created with
+	(and a given one must have) the THREAD_SAFE setting. Methods that are
+	not wrapped here are those of the Graph, and run synchronously.
+	"""
+
+	def __init__(self, graph=None, settings=None, workers=4):
+		super(AsyncGraph, self).__init__()
+		if graph is None:
+			settings = (settings or NodeRegistrySettings()).copy()
+			settings.THREAD_SAFE = True
+			graph = Graph(settings)
+		elif not graph.settings.THREAD_SAFE:
+			raise Exception('AsyncGraph: The Graph must be created with the THREAD_SAFE setting')
+		self.graph = graph
+		self.registry = graph.registry
+		self.executor = ThreadPoolExecutor(max_workers=workers,thread_name_prefix='pylog')
+
+		# Loads in flight or waiting for the next flush, by (name, depth,
+		# relations); waiting ones are grouped by (depth, relations)
+		self.inflight = {}
+		self.pending = {}
+		self.scheduled = False
+
+	def __getattr__(self,attr):
+		return getattr(self.graph,attr)
+
+	def _run(self,fn,*args):
+		return asyncio.get_running_loop().run_in_executor(self.executor,partial(fn,*args))
+
+	async def load(self,name,depth=None,relations=None):
+
+		"""
+		Loads the nodes with the given name(s) from the connected database,
+		like Graph.load()
+
+		returns NodeList of the nodes found
+		"""
+
+		names = enlist(name)
+		dbc = self.registry.dbc
+		if dbc.isConnected():
+			loop = asyncio.get_running_loop()
+			depth = self.registry.settings.LOAD_DEPTH if depth is None else depth
+			relations = tuple(sorted([r.lower() for r in enlist(relations)])) if relations else ()
+			waits = []
+			for n in names:
+				lname = n.lower()
+				if not depth:
+					node = self.registry.lookup.get(lname)
+					if node is not None and node.loaded:
+						continue
+				key = (lname,depth,relations)
+				future = self.inflight.get(key)
+				if future is None:
+					future = self.inflight[key] = loop.create_future()
+					self.pending.setdefault((depth,relations),{})[n] = key
+					if not self.scheduled:
+						self.scheduled = True
+						loop.call_soon(self._flush)
+				waits.append(future)
+			# The futures are shared with other callers, so cancelling this
+			#	one must not cancel them
+			if waits:
+				await asyncio.gather(*[asyncio.shield(w) for w in waits])
+		return self.registry.get(names,load=0)
+
+	def _flush(self):
+
+		"""
+		Private helper for load(), starts one load for all of the names
+		requested since the last flush (per depth and relations)
+		"""
+
+		self.scheduled = False
+		pending,self.pending = self.pending,{}
+		for (depth,relations),batch in pending.items():
+			task = self._run(self.registry.dbc.load,list(batch),depth,list(relations) or None)
+			task.add_done_callback(partial(self._loaded,list(batch.values())))
+
+	def _loaded(self,keys,task):
+
+		"""
+		Private helper for _flush(), resolves the futures of a finished load
+		"""
+
+		error = task.exception()
+		for key in keys:
+			future = self.inflight.pop(key)
+			if not future.done():
+				if error is not None:
+					future.set_exception(error)
+				else:
+					future.set_result(None)
+
+	async def get(self,name):
+		return await self.load(name)
+
+	async def rel(self,name):
+
+		"""
+		Awaitable Graph.rel(): all nodes related by the given name(s)
+		"""
+
+		await self.load(name)
+		out = self.registry.rel(name,load=0)
+		await self.load([n.name for n in out.index if not n.loaded])
+		return out
+
+	async def expand(self,nodes,name=None):
+
+		"""
+		Awaitable NodeList.rel(): the nodes related to `nodes` (a NodeList)
+		by the given `name`, with the relatives loaded
+		"""
+
+		await self.load([n.name for n in nodes.index if not n.loaded])
+		out = nodes.rel(name,load=0)
+		await self.load([n.name for n in out.index if not n.loaded])
+		return out
+
+	async def dump(self):
+		return await self._run(self.graph.dump)
+
+	async def read(self,filename,workers=1):
+		return await self._run(self.graph.read,filename,workers)
+
+	def close(self):
+
+		"""
+		Shuts the thread pool down and closes the database connections
+		"""
+
+		self.executor.shutdown()
+		self.registry.dbc.close()
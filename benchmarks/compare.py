@@ -0,0 +1,50 @@
+"""
+Compares two benchmark runs written by run.py:
+
+	python benchmarks/compare.py before.json after.json
+
+Prints the throughput, p50/p99 latency and peak memory of every scenario
+present in both runs, with the relative change from the first run to the
+second.
+"""
+
+import json
+import sys
+
+def load(filename):
+	with open(filename) as f:
+		data = json.load(f)
+	return data,dict([((r['graph'],r['size'],r['scenario']),r) for r in data['results']])
+
+def change(a,b):
+	if a is None or b is None or not a:
+		return ''
+	return '{0:+.1f}%'.format(100.0 * (b - a) / a)
+
+def fields(r):
+	latency = r['latency'] or {}
+	return [
+		('throughput',r['throughput']),
+		('p50',latency.get('p50')),
+		('p99',latency.get('p99')),
+		('memory',r['peakMemory'])
+	]
+
+def main(argv=None):
+	argv = argv if argv is not None else sys.argv[1:]
+	if len(argv) != 2:
+		sys.stderr.write('usage: compare.py BEFORE.json AFTER.json\n')
+		return 2
+	before,a = load(argv[0])
+	after,b = load(argv[1])
+	print('{0} -> {1}'.format((before['commit'] or '?')[:10],(after['commit'] or '?')[:10]))
+	for key in [k for k in a if k in b]:
+		cols = []
+		for (name,x),(_,y) in zip(fields(a[key]),fields(b[key])):
+			if x is not None and y is not None:
+				cols.append('{0} {1:.4g} -> {2:.4g} ({3})'.format(name,x,y,change(x,y)))
+		print('{0:>8} {1:>6} {2:>9}: {3}'.format(key[0],key[1],key[2],', '.join(cols)))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Seeded generators of synthetic graphs for the benchmarks.
+
+Every generator returns a list of (left, right, relation, weight) edges,
+where relations are bijective (as with Graph.biject()), and is fully
+determined by its `seed`.
+"""
+
+import math
+import random
+
+# Number of nodes for each named graph size
+SIZES = {
+	'small': 1000,
+	'medium': 10000,
+	'large': 100000
+}
+
+def social(nodes,seed=0,degree=5):
+
+	"""
+	Power-law social network grown by preferential attachment
+	(Barabási–Albert): every new person befriends `degree` existing people
+	picked in proportion to their number of friends, and follows a few of
+	them with a random weight
+	"""
+
+	rng = random.Random(seed)
+	targets = []
+	edges = []
+	for i in range(nodes):
+		name = 'person{0}'.format(i)
+		picked = set()
+		if targets:
+			while len(picked) < min(degree,i):
+				picked.add(rng.choice(targets))
+		for p in picked:
+			edges.append((name,p,'friends',rng.randint(1,5)))
+			if rng.random() < 0.3:
+				edges.append((name,p,'follows',1))
+			targets += [name,p]
+		if not picked:
+			targets.append(name)
+	return edges
+
+def grid(nodes,seed=0):
+
+	"""
+	Square grid of road intersections, each connected to its right and lower
+	neighbours by a road with a random length
+	"""
+
+	rng = random.Random(seed)
+	side = max(int(math.sqrt(nodes)),2)
+	edges = []
+	for x in range(side):
+		for y in range(side):
+			name = '{0},{1}'.format(x,y)
+			if x + 1 < side:
+				edges.append((name,'{0},{1}'.format(x+1,y),'road',rng.randint(1,9)))
+			if y + 1 < side:
+				edges.append((name,'{0},{1}'.format(x,y+1),'road',rng.randint(1,9)))
+	return edges
+
+GENERATORS = {
+	'social': social,
+	'grid': grid
+}
+
+def names(edges):
+
+	"""
+	Returns the sorted names of all nodes in `edges`
+	"""
+
+	return sorted(set([e[0] for e in edges] + [e[1] for e in edges]))
+
+def writeSource(edges,filename):
+
+	"""
+	Writes `edges` as a Reader source file
+	"""
+
+	with open(filename,'w') as f:
+		for left,right,relation,weight in edges:
+			f.write('rel `{0}` <{2}={2}> `{1}`*{3}\n'.format(left,right,relation,weight))
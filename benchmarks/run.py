@@ -0,0 +1,279 @@
+"""
+Benchmark suite for Pylog.
+
+Runs every scenario against seeded synthetic graphs of the given sizes and
+writes the results as JSON, so that runs on different commits can be
+compared with compare.py. Run from the repository root:
+
+	python benchmarks/run.py --sizes small,medium --out results.json
+
+Every result records the throughput of the scenario, the latency
+percentiles of its individual operations (where it has any) and its peak
+memory, measured with tracemalloc in a second, separate run of the
+scenario so that it does not skew the timings.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+import generate
+
+class Context(object):
+
+	"""
+	State shared by the scenarios run on one graph: its `edges`, node
+	`names`, the relation used for traversals, a temporary directory, and
+	the graph and database built by earlier scenarios
+	"""
+
+	def __init__(self, kind, size, edges, settings, tmp, seed):
+		super(Context, self).__init__()
+		self.kind = kind
+		self.size = size
+		self.edges = edges
+		self.names = generate.names(edges)
+		self.relation = edges[0][2]
+		self.settings = settings
+		self.tmp = tmp
+		self.rng = random.Random(seed)
+		self.graph = None
+		self.db = None
+
+	def newGraph(self):
+		return Graph(self.settings)
+
+	def built(self):
+
+		"""
+		Returns a graph holding all edges, building it once
+		"""
+
+		if self.graph is None:
+			self.graph = self.newGraph()
+			for left,right,relation,weight in self.edges:
+				self.graph.biject((left,weight),(right,weight),relation)
+		return self.graph
+
+	def database(self):
+
+		"""
+		Returns the file name of a database holding all edges, dumping the
+		built graph into it once
+		"""
+
+		if self.db is None:
+			self.db = os.path.join(self.tmp,'{0}-{1}.db'.format(self.kind,self.size))
+			g = self.built()
+			g.connect(self.db)
+			g.dump()
+			g.registry.dbc.close()
+		return self.db
+
+	def seeds(self,n):
+		return [self.rng.choice(self.names) for i in range(n)]
+
+
+def timed(fn,args):
+
+	"""
+	Calls `fn` for each entry of `args`, returns the list of latencies
+	"""
+
+	out = []
+	for a in args:
+		start = time.perf_counter()
+		fn(a)
+		out.append(time.perf_counter() - start)
+	return out
+
+# --- Scenarios
+#
+# Every scenario takes a Context and returns (operations, unit, latencies),
+# where `latencies` may be None for scenarios that run a single bulk
+# operation.
+
+def ingest(ctx):
+	filename = os.path.join(ctx.tmp,'{0}-{1}.txt'.format(ctx.kind,ctx.size))
+	if not os.path.exists(filename):
+		generate.writeSource(ctx.edges,filename)
+	ctx.newGraph().read(filename)
+	return (len(ctx.edges),'lines',None)
+
+def relate(ctx):
+	g = ctx.newGraph()
+	for left,right,relation,weight in ctx.edges:
+		g.biject((left,weight),(right,weight),relation)
+	return (len(ctx.edges),'edges',None)
+
+def hops(n):
+	def scenario(ctx):
+		g = ctx.built()
+		def query(name):
+			l = g.get(name)
+			for i in range(n):
+				l = l.rel(ctx.relation)
+			l.top(10)
+		seeds = ctx.seeds(200 if n < 3 else 50)
+		return (len(seeds),'queries',timed(query,seeds))
+	return scenario
+
+def setops(ctx):
+	g = ctx.built()
+	pairs = [(a,b) for a,b in zip(ctx.seeds(100),ctx.seeds(100))]
+	def query(pair):
+		a = g.get(pair[0]).rel(ctx.relation).rel(ctx.relation)
+		b = g.get(pair[1]).rel(ctx.relation).rel(ctx.relation)
+		a.limit(b)
+		a.exclude(b)
+		a.merge(b)
+	return (len(pairs),'queries',timed(query,pairs))
+
+def dump(ctx):
+	g = ctx.built()
+	filename = os.path.join(ctx.tmp,'dump.db')
+	if os.path.exists(filename):
+		os.remove(filename)
+	g.connect(filename)
+	g.dump()
+	g.registry.dbc.close()
+	return (len(ctx.edges),'edges',None)
+
+def coldLoad(ctx):
+	filename = ctx.database()
+	seeds = ctx.seeds(100)
+	def query(name):
+		g = ctx.newGraph()
+		g.connect(filename)
+		g.get(name).rel(ctx.relation).rel(ctx.relation)
+		g.registry.dbc.close()
+	return (len(seeds),'queries',timed(query,seeds))
+
+def warmLoad(ctx):
+	filename = ctx.database()
+	g = ctx.newGraph()
+	g.connect(filename)
+	seeds = ctx.seeds(100)
+	for name in seeds:
+		g.get(name).rel(ctx.relation).rel(ctx.relation)
+	def query(name):
+		g.get(name).rel(ctx.relation).rel(ctx.relation)
+	out = (len(seeds),'queries',timed(query,seeds))
+	g.registry.dbc.close()
+	return out
+
+SCENARIOS = [
+	('ingest',ingest),
+	('relate',relate),
+	('rel1',hops(1)),
+	('rel2',hops(2)),
+	('rel3',hops(3)),
+	('setops',setops),
+	('dump',dump),
+	('coldLoad',coldLoad),
+	('warmLoad',warmLoad)
+]
+
+def percentiles(latencies):
+	if not latencies:
+		return None
+	latencies = sorted(latencies)
+	def p(q):
+		return latencies[min(int(q * len(latencies)),len(latencies) - 1)]
+	return {'p50': p(0.5),'p90': p(0.9),'p99': p(0.99),'max': latencies[-1]}
+
+def run(name,scenario,ctx,memory):
+
+	"""
+	Runs a single scenario, returns its result record
+	"""
+
+	state = ctx.rng.getstate()
+	start = time.perf_counter()
+	ops,unit,latencies = scenario(ctx)
+	seconds = time.perf_counter() - start
+	if latencies:
+		# Leave out the set up of query scenarios
+		seconds = sum(latencies)
+	peak = None
+	if memory:
+		ctx.rng.setstate(state)
+		tracemalloc.start()
+		scenario(ctx)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	return {
+		'scenario': name,
+		'graph': ctx.kind,
+		'size': ctx.size,
+		'nodes': len(ctx.names),
+		'edges': len(ctx.edges),
+		'operations': ops,
+		'unit': unit,
+		'seconds': seconds,
+		'throughput': ops / seconds if seconds else None,
+		'latency': percentiles(latencies),
+		'peakMemory': peak
+	}
+
+def commit():
+	try:
+		return subprocess.check_output(['git','rev-parse','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError,subprocess.CalledProcessError):
+		return None
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Run the Pylog benchmarks')
+	parser.add_argument('--sizes',default='small',help='comma separated sizes: ' + ', '.join(generate.SIZES))
+	parser.add_argument('--graphs',default=','.join(generate.GENERATORS),help='comma separated graph kinds')
+	parser.add_argument('--scenarios',default=','.join([s[0] for s in SCENARIOS]),help='comma separated scenarios')
+	parser.add_argument('--seed',type=int,default=0)
+	parser.add_argument('--compact',action='store_true',help='use the CompactRegistry storage engine')
+	parser.add_argument('--no-memory',dest='memory',action='store_false',help='skip the peak memory runs')
+	parser.add_argument('--out',help='file to write the JSON results to (default: stdout)')
+	args = parser.parse_args(argv)
+
+	settings = NodeRegistrySettings()
+	settings.COMPACT_STORAGE = args.compact
+	scenarios = [s for s in SCENARIOS if s[0] in args.scenarios.split(',')]
+	results = []
+	tmp = tempfile.mkdtemp(prefix='pylog-bench-')
+	try:
+		for kind in args.graphs.split(','):
+			for size in args.sizes.split(','):
+				edges = generate.GENERATORS[kind](generate.SIZES[size],args.seed)
+				ctx = Context(kind,size,edges,settings,tmp,args.seed)
+				for name,scenario in scenarios:
+					res = run(name,scenario,ctx,args.memory)
+					results.append(res)
+					sys.stderr.write('{0:>8} {1:>6} {2:>9}: {3:12.1f} {4}/s\n'.format(kind,size,name,res['throughput'],res['unit']))
+	finally:
+		shutil.rmtree(tmp)
+
+	out = json.dumps({
+		'commit': commit(),
+		'python': platform.python_version(),
+		'compact': args.compact,
+		'seed': args.seed,
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'results': results
+	},indent=2)
+	if args.out:
+		with open(args.out,'w') as f:
+			f.write(out)
+	else:
+		print(out)
+
+if __name__ == '__main__':
+	main()
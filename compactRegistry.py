@@ -0,0 +1,464 @@
+from array import array
+from bisect import bisect_left
+from nodes import *
+from nodeRegistry import NodeRegistry
+
+class Relation(object):
+
+	"""
+	Compressed (CSR) storage for the edges of a single relation.
+
+	`rows` holds the sorted IDs of the nodes that have at least one edge;
+	the targets of the node at `rows[i]` are found in `targets` (sorted by ID)
+	and `weights` between `offsets[i]` and `offsets[i+1]`. Edges added since
+	the last compaction are kept in the `delta` buffer, mapping a source ID
+	to a dict of target IDs and weights, in the order they were added.
+
+	Unless `ordered` is False, `ranks` holds the position (from 0) of every
+	edge among those of its node in the order they were added, alongside
+	`targets`: edges() yields them in that order, so that NodeLists built
+	from them break ties between equal weights the same way as with the
+	default engine, before and after compaction.
+
+	`typecode` is that of the `weights` array; the reverse index of a
+	CompactRegistry, whose weights are all 0, uses bytes and no ranks.
+	"""
+
+	def __init__(self, typecode='q', ordered=True):
+		super(Relation, self).__init__()
+		self.rows = array('i')
+		self.offsets = array('q',[0])
+		self.targets = array('i')
+		self.weights = array(typecode)
+		self.ranks = array('i') if ordered else None
+		self.typecode = typecode
+		self.delta = {}
+		self.pending = 0
+
+	def __contains__(self,src):
+		return src in self.delta or self.row(src) is not None
+
+	def __len__(self):
+		return len(self.targets) + self.pending
+
+	def row(self,src):
+
+		"""
+		Returns the (start,end) slice of the compacted edges of `src`, or
+		None if it has none
+		"""
+
+		i = bisect_left(self.rows,src)
+		if i < len(self.rows) and self.rows[i] == src:
+			return (self.offsets[i],self.offsets[i+1])
+		return None
+
+	def find(self,src,dst):
+
+		"""
+		Returns the position of the compacted edge from `src` to `dst`, or -1
+		"""
+
+		row = self.row(src)
+		if row:
+			i = bisect_left(self.targets,dst,row[0],row[1])
+			if i < row[1] and self.targets[i] == dst:
+				return i
+		return -1
+
+	def add(self,src,dst,weight,accumulate):
+
+		"""
+		Adds an edge from `src` to `dst`. If the edge already exists, its
+		weight is increased only if `accumulate` is True. Returns True if the
+		relation changed.
+		"""
+
+		d = self.delta.get(src)
+		if d and dst in d:
+			if accumulate:
+				d[dst] += weight
+			return accumulate
+		i = self.find(src,dst)
+		if i >= 0:
+			if accumulate:
+				self.weights[i] += weight
+			return accumulate
+		if d is None:
+			d = self.delta[src] = {}
+		d[dst] = weight
+		self.pending += 1
+		return True
+
+	def edges(self,src):
+
+		"""
+		Yields (target ID, weight) pairs for every edge of `src`, in the
+		order they were added if the relation is `ordered`
+		"""
+
+		row = self.row(src)
+		if row:
+			span = range(row[0],row[1])
+			if self.ranks is not None:
+				span = sorted(span,key=self.ranks.__getitem__)
+			for i in span:
+				yield (self.targets[i],self.weights[i])
+		if src in self.delta:
+			for e in self.delta[src].items():
+				yield e
+
+	def drop(self,srcs):
+
+		"""
+		Removes all of the edges of the nodes with the given (set of) IDs
+		"""
+
+		for src in srcs:
+			d = self.delta.pop(src,None)
+			if d:
+				self.pending -= len(d)
+		if not any(r in srcs for r in self.rows):
+			return
+		rows = array('i')
+		offsets = array('q',[0])
+		targets = array('i')
+		weights = array(self.typecode)
+		ranks = None if self.ranks is None else array('i')
+		for i in range(len(self.rows)):
+			if self.rows[i] not in srcs:
+				rows.append(self.rows[i])
+				targets.extend(self.targets[self.offsets[i]:self.offsets[i+1]])
+				weights.extend(self.weights[self.offsets[i]:self.offsets[i+1]])
+				if ranks is not None:
+					ranks.extend(self.ranks[self.offsets[i]:self.offsets[i+1]])
+				offsets.append(len(targets))
+		self.rows = rows
+		self.offsets = offsets
+		self.targets = targets
+		self.weights = weights
+		self.ranks = ranks
+
+	def dropTargets(self,dsts):
+
+		"""
+		Removes all of the edges to the nodes with the given (set of) IDs
+		"""
+
+		for src,d in list(self.delta.items()):
+			for dst in [t for t in d if t in dsts]:
+				del d[dst]
+				self.pending -= 1
+			if not d:
+				del self.delta[src]
+		if not any(t in dsts for t in self.targets):
+			return
+		rows = array('i')
+		offsets = array('q',[0])
+		targets = array('i')
+		weights = array(self.typecode)
+		ranks = None if self.ranks is None else array('i')
+		for i in range(len(self.rows)):
+			kept = [j for j in range(self.offsets[i],self.offsets[i+1]) if self.targets[j] not in dsts]
+			targets.extend([self.targets[j] for j in kept])
+			weights.extend([self.weights[j] for j in kept])
+			if ranks is not None:
+				# Renumber the remaining edges, so that ranks stay dense
+				order = sorted(range(len(kept)),key=lambda k: self.ranks[kept[k]])
+				dense = [0] * len(kept)
+				for rank,k in enumerate(order):
+					dense[k] = rank
+				ranks.extend(dense)
+			if len(targets) > offsets[-1]:
+				rows.append(self.rows[i])
+				offsets.append(len(targets))
+		self.rows = rows
+		self.offsets = offsets
+		self.targets = targets
+		self.weights = weights
+		self.ranks = ranks
+
+	def sources(self):
+
+		"""
+		Returns the sorted IDs of all nodes with at least one edge
+		"""
+
+		if not self.delta:
+			return list(self.rows)
+		return sorted(set(self.rows).union(self.delta))
+
+	def compact(self):
+
+		"""
+		Merges the delta buffer into the compacted arrays, in a single pass:
+		runs of rows without new edges are copied over as they are, and
+		the new edges of the others are merged into them, ranked after the
+		edges they already had
+		"""
+
+		if not self.delta:
+			return
+		rows = array('i')
+		offsets = array('q',[0])
+		targets = array('i')
+		weights = array(self.typecode)
+		ranks = None if self.ranks is None else array('i')
+		old = self.rows
+		count = len(old)
+		done = 0
+		for src in sorted(self.delta):
+			i = bisect_left(old,src,done)
+			self._copy(rows,offsets,targets,weights,ranks,done,i)
+			edges = []
+			if i < count and old[i] == src:
+				start = self.offsets[i]
+				end = self.offsets[i+1]
+				if ranks is None:
+					edges.extend(zip(self.targets[start:end],self.weights[start:end]))
+				else:
+					edges.extend(zip(self.targets[start:end],self.weights[start:end],self.ranks[start:end]))
+				i += 1
+			d = self.delta[src]
+			if ranks is None:
+				edges.extend(d.items())
+			else:
+				base = len(edges)
+				edges.extend(zip(d.keys(),d.values(),range(base,base + len(d))))
+			edges.sort()
+			columns = list(zip(*edges))
+			rows.append(src)
+			targets.extend(columns[0])
+			weights.extend(columns[1])
+			if ranks is not None:
+				ranks.extend(columns[2])
+			offsets.append(len(targets))
+			done = i
+		self._copy(rows,offsets,targets,weights,ranks,done,count)
+		self.rows = rows
+		self.offsets = offsets
+		self.targets = targets
+		self.weights = weights
+		self.ranks = ranks
+		self.delta = {}
+		self.pending = 0
+
+	def _copy(self,rows,offsets,targets,weights,ranks,lo,hi):
+
+		"""
+		Private helper for compact(), appends the compacted rows from `lo` to
+		`hi` (excluded) to the given arrays
+		"""
+
+		if lo >= hi:
+			return
+		start = self.offsets[lo]
+		end = self.offsets[hi]
+		shift = len(targets) - start
+		rows.extend(self.rows[lo:hi])
+		targets.extend(self.targets[start:end])
+		weights.extend(self.weights[start:end])
+		if ranks is not None:
+			ranks.extend(self.ranks[start:end])
+		offsets.extend([o + shift for o in self.offsets[lo+1:hi+1]])
+
+	def full(self,limit):
+
+		"""
+		Returns True if the delta buffer should be compacted: once it holds
+		`limit` edges, or half as many as were compacted if that is more,
+		so that the cost of compacting stays linear in the number of edges
+		"""
+
+		return self.pending >= limit and self.pending >= len(self.targets) // 2
+
+
+class NodeRelations(object):
+
+	"""
+	Read-only view of the relationships of a single node within a
+	CompactRegistry, behaving like the {relation: NodeList} dicts of the
+	default engine
+	"""
+
+	def __init__(self,registry,node):
+		super(NodeRelations, self).__init__()
+		self.registry = registry
+		self.node = node
+
+	def __contains__(self,relation):
+		rel = self.registry.relations.get(getattr(relation,'id',None))
+		return rel is not None and self.node.id in rel
+
+	def __iter__(self):
+		nodes = self.registry.nodes
+		for rid,rel in self.registry.relations.items():
+			if self.node.id in rel:
+				yield nodes[rid]
+
+	def __getitem__(self,relation):
+		if relation not in self:
+			raise KeyError(relation)
+		nodes = self.registry.nodes
+		rel = self.registry.relations[relation.id]
+		return NodeList.fromTuples([NodeTuple(nodes[t],w) for t,w in rel.edges(self.node.id)],self.registry)
+
+	def keys(self):
+		return list(self)
+
+	def items(self):
+		return [(r,self[r]) for r in self]
+
+
+class CompactIncoming(object):
+
+	"""
+	Read-only view standing in for NodeRegistry.incoming, mapping each Node
+	of a CompactRegistry to a {relation: set of source Nodes} dict read from
+	the reverse index
+	"""
+
+	def __init__(self,registry):
+		super(CompactIncoming, self).__init__()
+		self.registry = registry
+
+	def get(self,node,default=None):
+		nodes = self.registry.nodes
+		i = getattr(node,'id',-1)
+		out = {}
+		for rid,inverse in self.registry.inverses.items():
+			if i in inverse:
+				out[nodes[rid]] = set([nodes[s] for s,w in inverse.edges(i)])
+		return out or default
+
+	def __contains__(self,node):
+		return self.get(node) is not None
+
+	def __getitem__(self,node):
+		out = self.get(node)
+		if out is None:
+			raise KeyError(node)
+		return out
+
+
+class CompactAdjacency(object):
+
+	"""
+	Read-only view standing in for NodeRegistry.registry, mapping each Node
+	of a CompactRegistry to a NodeRelations view
+	"""
+
+	def __init__(self,registry):
+		super(CompactAdjacency, self).__init__()
+		self.registry = registry
+
+	def __contains__(self,node):
+		nodes = self.registry.nodes
+		i = getattr(node,'id',-1)
+		return 0 <= i < len(nodes) and nodes[i] is node
+
+	def __iter__(self):
+		return iter(self.registry.nodes)
+
+	def __len__(self):
+		return len(self.registry.nodes)
+
+	def __getitem__(self,node):
+		if node not in self:
+			raise KeyError(node)
+		return NodeRelations(self.registry,node)
+
+	def keys(self):
+		return list(self.registry.nodes)
+
+	def items(self):
+		return [(n,self[n]) for n in self.registry.nodes]
+
+
+class CompactRegistry(NodeRegistry):
+
+	"""
+	NodeRegistry storage engine that interns every node to a dense integer
+	ID (`Node.id`, indexing `nodes`) and keeps the edges of each relation in
+	a Relation, keyed by the relation's ID in `relations`.
+
+	With INDEX_INCOMING, the incoming edges of each relation are kept the
+	same way, reversed (target to sources), in `inverses`.
+
+	`registry` and `incoming` are read-only views with the same shape as the
+	default engine's; all writes go through relate().
+	"""
+
+	def __init__(self,graph,settings=None):
+		self.nodes = []
+		self.relations = {}
+		self.inverses = {}
+		super(CompactRegistry, self).__init__(graph,settings)
+		self.registry = CompactAdjacency(self)
+		self.incoming = CompactIncoming(self)
+
+	def _register(self,node):
+		node.id = len(self.nodes)
+		self.nodes.append(node)
+
+	def _link(self,node,relation,relative,weight):
+		rel = self.relations.get(relation.id)
+		if rel is None:
+			rel = self.relations[relation.id] = Relation()
+		out = rel.add(node.id,relative.id,weight,self.settings.ACCUMULATE_RELATIONSHIPS)
+		if rel.full(self.settings.COMPACT_DELTA_LIMIT):
+			rel.compact()
+		return out
+
+	def _index(self,node,relation,relative):
+		if self.settings.INDEX_INCOMING:
+			inverse = self.inverses.get(relation.id)
+			if inverse is None:
+				inverse = self.inverses[relation.id] = Relation('b',False)
+			inverse.add(relative.id,node.id,0,False)
+			if inverse.full(self.settings.COMPACT_DELTA_LIMIT):
+				inverse.compact()
+
+	def _weight(self,node,relation,relative):
+		rel = self.relations[relation.id]
+		d = rel.delta.get(node.id)
+		if d and relative.id in d:
+			return d[relative.id]
+		return rel.weights[rel.find(node.id,relative.id)]
+
+	def _drop(self,nodes):
+		ids = set([n.id for n in nodes])
+		acc = self.settings.ACCUMULATE_RELATIONSHIPS
+		for rid,rel in self.relations.items():
+			members = self.participants.get(self.nodes[rid])
+			targets = set()
+			for src in ids:
+				for dst,w in rel.edges(src):
+					targets.add(dst)
+					if acc and members and self.nodes[dst] in members:
+						members[self.nodes[dst]] -= 1
+						if members[self.nodes[dst]] <= 0:
+							del members[self.nodes[dst]]
+			rel.drop(ids)
+
+			# Without accumulation, nodes participate until the last edge to
+			#	them is dropped
+			inverse = self.inverses.get(rid)
+			if inverse is not None:
+				inverse.dropTargets(ids)
+				if not acc and members:
+					for dst in targets:
+						if dst not in inverse:
+							members.pop(self.nodes[dst],None)
+
+	def compact(self):
+
+		"""
+		Merges the delta buffers of all relations into their arrays
+		"""
+
+		with self.lock.write():
+			for rel in self.relations.values():
+				rel.compact()
+			for inverse in self.inverses.values():
+				inverse.compact()
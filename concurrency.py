@@ -0,0 +1,117 @@
+import threading
+
+class RWLock(object):
+
+	"""
+	Readers-writer lock. Any number of threads may hold it for reading at
+	once, while writers hold it alone; waiting writers keep new readers out
+	so that they are not starved.
+
+	The write lock is reentrant, and a thread holding it may also read.
+	A thread holding only the read lock must not ask for the write lock:
+	code reading the graph releases the read lock before loading nodes.
+	"""
+
+	def __init__(self):
+		super(RWLock, self).__init__()
+		self.cond = threading.Condition(threading.Lock())
+		self.readers = 0
+		self.writer = None
+		self.depth = 0
+		self.waiting = 0
+		self.held = threading.local()
+
+	def read(self):
+		return _Held(self.acquireRead,self.releaseRead)
+
+	def write(self):
+		return _Held(self.acquireWrite,self.releaseWrite)
+
+	def acquireRead(self):
+
+		"""
+		Acquires the lock for reading. Nested reads (and reads by the writer)
+		only count how deep the thread is, so they never wait for writers.
+		"""
+
+		held = getattr(self.held,'reads',0)
+		if held or self.writer == threading.get_ident():
+			self.held.reads = held + 1
+			return
+		with self.cond:
+			while self.writer is not None or self.waiting:
+				self.cond.wait()
+			self.readers += 1
+		self.held.reads = 1
+
+	def releaseRead(self):
+		held = self.held.reads - 1
+		self.held.reads = held
+		if held or self.writer == threading.get_ident():
+			return
+		with self.cond:
+			self.readers -= 1
+			if not self.readers:
+				self.cond.notify_all()
+
+	def acquireWrite(self):
+		me = threading.get_ident()
+		with self.cond:
+			if self.writer == me:
+				self.depth += 1
+				return
+			self.waiting += 1
+			while self.writer is not None or self.readers:
+				self.cond.wait()
+			self.waiting -= 1
+			self.writer = me
+			self.depth = 1
+
+	def releaseWrite(self):
+		with self.cond:
+			self.depth -= 1
+			if not self.depth:
+				self.writer = None
+				self.cond.notify_all()
+
+
+class NullLock(object):
+
+	"""
+	Stand-in for RWLock (and threading.Lock) used when the graph is not
+	shared between threads; acquiring it does nothing
+	"""
+
+	def read(self):
+		return self
+
+	def write(self):
+		return self
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+NULL_LOCK = NullLock()
+
+class _Held(object):
+
+	"""
+	Context manager returned by RWLock.read() and RWLock.write()
+	"""
+
+	__slots__ = ('acquire','release')
+
+	def __init__(self, acquire, release):
+		self.acquire = acquire
+		self.release = release
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, *exc):
+		self.release()
+		return False
@@ -1,46 +1,152 @@
 import sqlite3
+import threading
+import time
 from common import *
+from profiler import PROFILER
+from nameindex import trigrams, rank, upper
 
 class DBC(object):
 	"""docstring for DBC"""
 	def __init__(self, registry):
 		super(DBC, self).__init__()
 		self.registry = registry
-		self.connection = None
-		
+		self.filename = None
+		self.pool = None
+		self.poolLock = threading.Lock()
+		self._connection = None
+
+		# Changes made since the last dump: nodes (an ordered set) and the
+		# weight added to each (node, relation, relative) edge. Changes are
+		# only tracked while connected and not loading; `full` marks that
+		# the whole graph must be written on the next dump.
+		self.dirtyNodes = {}
+		self.dirtyEdges = {}
+		self.tracking = False
+		self.full = False
+
+		# Database IDs of the nodes written or resolved so far, which are
+		#	only valid for the connected database as it is
+		self.ids = {}
+
+		# Number of hops of the neighborhood of each node that was loaded
+		#	along with it, for nodes loaded with a depth (see load())
+		self.depths = {}
+
 	def connect(self,filename):
 		"""
 		Connect to a SQLite Database, creates new Database if one with the given
 			file name doesn't exist
+
+		With the THREAD_SAFE setting, every thread opens its own connection
+		to the database when it first uses it, and the database is switched
+		to WAL mode so that reading threads and the writing thread don't
+		block each other.
 		"""
-		if self.connection:
-			self.connection.close()
-		self.connection = sqlite3.connect(filename)
+		self.close()
+		self.filename = filename
+		self.ids = {}
+		self.depths = {}
+		if self.registry.settings.THREAD_SAFE:
+			self.pool = {}
+		self._connection = self._open()
 
 		if not self.isInitialized():
 			self.initialize(imsure=True)
+		elif self.registry.settings.FUZZY_INDEX:
+			with self.connection:
+				c = self.connection.cursor()
+				self._indexNames(c)
+				c.close()
+
+		# Anything already in memory has not been stored in this database
+		self.dirtyNodes = {}
+		self.dirtyEdges = {}
+		self.full = len(self.registry.lookup) > 0
+		self.tracking = True
+
+	def _open(self):
+
+		"""
+		Private helper, opens a new connection to the database. Pooled
+		connections are put in WAL mode and kept for the calling thread; the
+		connections of threads that have finished are closed meanwhile.
+		"""
+
+		if self.pool is None:
+			return sqlite3.connect(self.filename)
+		connection = sqlite3.connect(self.filename,check_same_thread=False)
+		connection.execute("PRAGMA journal_mode=WAL")
+		with self.poolLock:
+			for thread in [t for t in self.pool if not t.is_alive()]:
+				self.pool.pop(thread).close()
+			self.pool[threading.current_thread()] = connection
+		return connection
+
+	@property
+	def connection(self):
+
+		"""
+		The connection to the database, or None if not connected. With the
+		THREAD_SAFE setting, the calling thread's own connection.
+		"""
+
+		if self.pool is None or self._connection is None:
+			return self._connection
+		connection = self.pool.get(threading.current_thread())
+		return connection if connection is not None else self._open()
+
+	@connection.setter
+	def connection(self,value):
+		if value is None:
+			self.close()
+		else:
+			self._connection = value
+
+	def close(self):
+
+		"""
+		Closes the connection(s) to the database, and stops tracking changes:
+		those not dumped yet are forgotten, as is everything known about the
+		database
+		"""
+
+		with self.poolLock:
+			for connection in (list(self.pool.values()) if self.pool is not None else [self._connection]):
+				if connection is not None:
+					connection.close()
+			self._connection = None
+			self.pool = None
+		self.dirtyNodes = {}
+		self.dirtyEdges = {}
+		self.tracking = False
+		self.full = False
+		self.ids = {}
+		self.depths = {}
 
 	def isInitialized(self):
 		c = self.connection.cursor()
 		return c.execute("SELECT COUNT(1) FROM sqlite_master WHERE type='table' AND name IN ('NODES','RELATIONSHIPS')").fetchall()[0][0]
 
 	def isConnected(self):
-		return type(self.connection) == sqlite3.Connection;
+		return type(self._connection) == sqlite3.Connection
 
 	def initialize(self,imsure=False):
 
 		"""
 		Initialize the connected database. Will remove all existing graph data:
-		only tables NODES and RELATIONSHIP will be dropped and recreated. They
-		will not be populated.
+		only tables NODES and RELATIONSHIP (and NGRAMS, see FUZZY_INDEX) will be
+		dropped and recreated. They will not be populated.
 
 		`imsure` will override the terminal confirmation prompt that is
 		otherwise presented before initializing the database if it is True
 		"""
 		if imsure or input("Are you sure you want to initialize? This will remove all existing graph data from the database:") == 'y':
+			self.ids = {}
 			c = self.connection.cursor()
 			c.execute("DROP TABLE IF EXISTS NODES")
 			c.execute("DROP TABLE IF EXISTS RELATIONSHIPS")
+			c.execute("DROP TABLE IF EXISTS NGRAMS")
+			c.execute("DROP TABLE IF EXISTS NGRAMSTATE")
 			c.execute("""
 					CREATE TABLE NODES (
 							ID INTEGER PRIMARY KEY,
@@ -70,102 +176,445 @@ class DBC(object):
 							RELATION
 						)
 				""")
+			if self.registry.settings.FUZZY_INDEX:
+				self._indexNames(c)
 			self.connection.commit()
 			c.close()
+			self.full = len(self.registry.lookup) > 0
 
-	def dump(self):
+	def trackNode(self,node):
 
 		"""
-		Put all unstored graph data into the connected database.
+		Record that `node` was created since the last dump
 		"""
 
-		c = self.connection.cursor()
+		if self.tracking:
+			self.dirtyNodes[node] = True
 
-		# Get next node numeric ID
-		idx = (c.execute("SELECT MAX(ID) FROM NODES").fetchall()[0][0] or 0) + 1
+	def trackEdge(self,node,relation,relative,weight):
+
+		"""
+		Record that `weight` was added to the edge from `node` to `relative`
+		by `relation` since the last dump. Private relations (those starting
+		with an underscore) are never stored.
+		"""
 
-		# Insert all nodes into DB
-		for name,node in self.registry.lookup.items():
+		if self.tracking and relation.name[0] != '_':
+			key = (node,relation,relative)
+			self.dirtyEdges[key] = self.dirtyEdges.get(key,0) + weight
+
+	def stored(self,names):
+
+		"""
+		Get the Nodes for the given `names` of nodes stored in the database.
+		Nodes missing from the registry are created (but not loaded) without
+		being tracked as changes.
+		"""
+
+		with self.registry.lock.write():
+			tracking = self.tracking
+			self.tracking = False
 			try:
-				c.execute("INSERT INTO NODES VALUES(?,?)",[idx,name])
-				node._dbidx = idx
-				idx += 1
-			except sqlite3.IntegrityError:
-				# Node already exists
-				node._dbidx = c.execute("SELECT ID FROM NODES WHERE NAME = ?",[name]).fetchall()[0][0]
+				return [self.registry._add(n) for n in names]
+			finally:
+				self.tracking = tracking
 
-		# Create all relationships
-		for node,info in self.registry.registry.items():
+	def isDirty(self):
+		return self.full or len(self.dirtyNodes) > 0 or len(self.dirtyEdges) > 0
 
-			# Iteratre over each node's relations, skipping over private ones
-			#	(those starting with an underscore)
+	def _allEdges(self):
+
+		"""
+		Private helper for dump(), yields every stored edge of the graph as
+		(node, relation, relative, weight)
+		"""
+
+		for node,info in self.registry.registry.items():
 			for relation,relatives in info.items():
-				
-				if hasattr(relation,"_dbidx"):
-					if relation.name[0] != '_':
-						for relative in relatives:
-							try:
-								c.execute("INSERT INTO RELATIONSHIPS VALUES(?,?,?,?)",[node._dbidx,relative.node._dbidx,relation._dbidx,relative.weight])
-							except sqlite3.IntegrityError as e:
-								# Relationship is already in database
-								pass
+				if relation.name[0] != '_':
+					for relative in relatives:
+						yield (node,relation,relative.node,relative.weight)
+
+	def _resolve(self,c,nodes):
+
+		"""
+		Private helper for dump(), records the database IDs of all of the
+		given nodes that aren't known yet in `ids`, with one query per batch
+		of names
+		"""
+
+		ids = self.ids
+		names = {}
+		for n in nodes:
+			if n not in ids:
+				names[n.name.lower()] = n
+		names = list(names.items())
+		for i in range(0,len(names),500):
+			batch = dict(names[i:i+500])
+			nameMask = ','.join('?'*len(batch))
+			for idx,name in c.execute("SELECT ID, NAME FROM NODES WHERE NAME IN (%s)" % nameMask,list(batch)):
+				ids[batch[name]] = idx
+			if PROFILER.enabled:
+				PROFILER.count('sql.statements')
+
+	def dump(self):
+
+		"""
+		Put all unstored graph data into the connected database.
+
+		Only the nodes and relationships created (or, with
+		ACCUMULATE_RELATIONSHIPS, given more weight) since the last dump are
+		written, in a single transaction.
+
+		returns a dict with the number of `nodes` and `relationships` rows
+		written
+		"""
+
+		# Take the changes to write under the lock, so that the graph can be
+		#	read (and changed) while they are written
+		start = time.perf_counter() if PROFILER.enabled else 0
+		with self.registry.lock.write():
+			full = self.full
+			if full:
+				nodes = list(self.registry.lookup.values())
+				edges = list(self._allEdges())
+			else:
+				nodes = list(self.dirtyNodes)
+				edges = [k + (w,) for k,w in self.dirtyEdges.items()]
+			self.dirtyNodes = {}
+			self.dirtyEdges = {}
+			self.full = False
+
+		# Relationships that already exist are left alone unless weights are
+		#	accumulated, in which case only the added weight is applied
+		if self.registry.settings.ACCUMULATE_RELATIONSHIPS and not full:
+			conflict = "DO UPDATE SET WEIGHT = WEIGHT + excluded.WEIGHT"
+		else:
+			conflict = "DO NOTHING"
+
+		try:
+			with self.connection:
+				c = self.connection.cursor()
+				c.executemany("INSERT INTO NODES(NAME) VALUES(?) ON CONFLICT(NAME) DO NOTHING",[(n.name.lower(),) for n in nodes])
+				written = {'nodes': max(c.rowcount,0)}
+				self._resolve(c,nodes + [n for e in edges for n in e[:3]])
+				ids = self.ids
+				c.executemany("""
+						INSERT INTO RELATIONSHIPS VALUES(?,?,?,?)
+						ON CONFLICT(NODELEFT,NODERIGHT,RELATION) %s
+					""" % conflict,[(ids[e[0]],ids[e[2]],ids[e[1]],e[3]) for e in edges])
+				written['relationships'] = max(c.rowcount,0)
+				if self.registry.settings.FUZZY_INDEX:
+					self._indexNames(c)
+				c.close()
+		except:
+
+			# Nothing was written; the changes are still to be dumped, and
+			#	the IDs of the nodes that were inserted are void
+			self.ids = {}
+			with self.registry.lock.write():
+				if full:
+					self.full = True
 				else:
-					# Should never happen, but leaving it here just in case
-					print("[WARN] {0}: Relation ID not found".format(relation.node.name))
+					for n in nodes:
+						self.dirtyNodes[n] = True
+					for e in edges:
+						self.dirtyEdges[e[:3]] = self.dirtyEdges.get(e[:3],0) + e[3]
+			raise
+
+		if start:
+			PROFILER.count('sql.statements',2)
+			PROFILER.record('dbc.dump',start,written['nodes'] + written['relationships'])
+		return written
+
+	def insertEdges(self,edges):
+
+		"""
+		Writes (left, relation, right, weight) edges between named nodes
+		straight into the connected database, in a single transaction.
+		Weights are added to those of existing relationships when
+		ACCUMULATE_RELATIONSHIPS is set. Edges from nodes that are loaded are
+		also related in memory, so that they stay consistent with the
+		database; other nodes are not loaded.
+
+		returns the number of `edges` written
+		"""
+
+		acc = self.registry.settings.ACCUMULATE_RELATIONSHIPS
+		conflict = "DO UPDATE SET WEIGHT = WEIGHT + excluded.WEIGHT" if acc else "DO NOTHING"
+		edges = [(l.lower(),r.lower(),t.lower(),w) for l,r,t,w in edges]
+		names = list(set([n for e in edges for n in e[:3]]))
+		with self.connection:
+			c = self.connection.cursor()
+			c.executemany("INSERT INTO NODES(NAME) VALUES(?) ON CONFLICT(NAME) DO NOTHING",[(n,) for n in names])
+			ids = {}
+			for i in range(0,len(names),500):
+				batch = names[i:i+500]
+				ids.update([(name,idx) for idx,name in c.execute("SELECT ID, NAME FROM NODES WHERE NAME IN (%s)" % ','.join('?'*len(batch)),batch)])
+			c.executemany("""
+					INSERT INTO RELATIONSHIPS VALUES(?,?,?,?)
+					ON CONFLICT(NODELEFT,NODERIGHT,RELATION) %s
+				""" % conflict,[(ids[e[0]],ids[e[2]],ids[e[1]],e[3]) for e in edges])
+			if self.registry.settings.FUZZY_INDEX:
+				self._indexNames(c)
+			c.close()
+
+		# Write through to the nodes that are loaded
+		loaded = []
+		for l,r,t,w in edges:
+			node = self.registry.lookup.get(l)
+			if node is not None and node.loaded:
+				loaded.append(([(l,1)],[(t,w)],None,r))
+		if loaded:
+			with self.registry.lock.write():
+				tracking = self.tracking
+				self.tracking = False
+				try:
+					self.registry.relateBatch(loaded)
+				finally:
+					self.tracking = tracking
+		if PROFILER.enabled:
+			PROFILER.count('sql.statements',2 + (len(names) + 499) // 500)
+		return len(edges)
+
+	def exportEdges(self):
+
+		"""
+		Yields every relationship stored in the connected database as a
+		(left, relation, right, weight) tuple of names, reading them from a
+		cursor as they are consumed
+		"""
+
+		c = self.connection.cursor()
+		try:
+			c.execute("""
+					SELECT
+						L.NAME,
+						R.NAME,
+						T.NAME,
+						K.WEIGHT
+					FROM
+						RELATIONSHIPS K
+						JOIN NODES L ON L.ID = K.NODELEFT
+						JOIN NODES R ON R.ID = K.RELATION
+						JOIN NODES T ON T.ID = K.NODERIGHT
+				""")
+			while True:
+				rows = c.fetchmany(1000)
+				if not rows:
+					break
+				for row in rows:
+					yield row
+		finally:
+			c.close()
+
+	def _indexNames(self,c):
 
-		self.connection.commit()
+		"""
+		Private helper, adds the trigrams of the names of all nodes that were
+		stored since the last time to the NGRAMS table (creating it if
+		needed), using cursor `c`. Node IDs only grow, so these are the nodes
+		with a greater ID than the last one indexed, which is kept in the
+		one-row NGRAMSTATE table. Databases indexed before it existed have it
+		filled in from NGRAMS once.
+		"""
+
+		c.execute("""
+				CREATE TABLE IF NOT EXISTS NGRAMS (
+						GRAM TEXT,
+						NODE INT,
+						PRIMARY KEY(GRAM,NODE),
+						FOREIGN KEY(NODE) REFERENCES NODES(ID)
+					) WITHOUT ROWID
+			""")
+		c.execute("CREATE TABLE IF NOT EXISTS NGRAMSTATE (LASTNODE INT)")
+		row = c.execute("SELECT LASTNODE FROM NGRAMSTATE").fetchone()
+		if row is None:
+			last = c.execute("SELECT IFNULL(MAX(NODE),0) FROM NGRAMS").fetchone()[0]
+			c.execute("INSERT INTO NGRAMSTATE VALUES(?)",(last,))
+		else:
+			last = row[0]
+		rows = c.execute("SELECT ID, NAME FROM NODES WHERE ID > ?",(last,)).fetchall()
+		if rows:
+			c.executemany("INSERT OR IGNORE INTO NGRAMS VALUES(?,?)",[(g,idx) for idx,name in rows for g in trigrams(name)])
+			c.execute("UPDATE NGRAMSTATE SET LASTNODE = ?",(max([r[0] for r in rows]),))
+		if PROFILER.enabled:
+			PROFILER.count('sql.statements',6 if rows else 4)
+
+	def prefix(self,prefix,limit):
+
+		"""
+		Returns the first `limit` names stored in the database starting with
+		the lowercased `prefix`, in order, found with the index of NODES
+		"""
+
+		end = upper(prefix)
+		c = self.connection.cursor()
+		if end is None:
+			rows = c.execute("SELECT NAME FROM NODES ORDER BY NAME LIMIT ?",(limit,)).fetchall()
+		else:
+			rows = c.execute("SELECT NAME FROM NODES WHERE NAME >= ? AND NAME < ? ORDER BY NAME LIMIT ?",(prefix,end,limit)).fetchall()
 		c.close()
+		if PROFILER.enabled:
+			PROFILER.count('sql.statements')
+		return [r[0] for r in rows]
 
-	def load(self,name):
+	def match(self,query,limit):
+
+		"""
+		Returns the `limit` names stored in the database sharing the most
+		trigrams with the lowercased `query`, as (name, number of trigrams
+		shared) pairs, found with the NGRAMS table (see FUZZY_INDEX)
+		"""
+
+		grams = list(trigrams(query))
+		c = self.connection.cursor()
+		rows = c.execute("""
+				SELECT
+					N.NAME,
+					COUNT(1) AS SCORE
+				FROM
+					NGRAMS G
+					JOIN NODES N ON N.ID = G.NODE
+				WHERE
+					G.GRAM IN (%s)
+				GROUP BY
+					G.NODE
+				ORDER BY
+					SCORE DESC,
+					ABS(LENGTH(N.NAME) - ?),
+					N.NAME
+				LIMIT ?
+			""" % ','.join('?'*len(grams)),grams + [len(query),limit]).fetchall()
+		c.close()
+		if PROFILER.enabled:
+			PROFILER.count('sql.statements')
+		return rank(dict(rows),query,limit)
+
+	def load(self,name,depth=None,relations=None):
 
 		"""
 		Read graph data from database starting at node with the given name.
 
 		`name` must be a string name or a list of string names
+		`depth` is the number of hops of the neighborhood around the named
+			nodes to load along with them, all in a single query. Defaults to
+			the LOAD_DEPTH setting.
+		`relations` may be a string or list of strings; if given, only these
+			relations are followed when walking the neighborhood. All of the
+			relationships of every reached node are still loaded, so that
+			they can be marked as loaded.
 		"""
 
+		start = time.perf_counter() if PROFILER.enabled else 0
 		name = enlist(name)
+		depth = self.registry.settings.LOAD_DEPTH if depth is None else depth
+		relations = [r.lower() for r in enlist(relations)] if relations else []
 
-		# Get names of unloaded / non-existent nodes matching input name(s)
-		nex = [n for n in name if not self.registry.get(n,load=0).isLoaded()]
+		# Get names of unloaded / non-existent nodes matching input name(s),
+		#	and of those whose neighborhood was not loaded as deep. Loads
+		#	that only follow some relations are never recorded as deep.
+		def covered(n):
+			node = self.registry.lookup.get(n.lower())
+			return node is not None and node.loaded and (not depth or self.depths.get(node,0) >= depth)
+		nex = [n for n in name if not covered(n)]
 
 		if len(nex):
 
 			c = self.connection.cursor()
 
-			# Query DB to get list of IDs for each node in the existing list `nex`
+			# Walk the neighborhood of the nodes in the list `nex` and get all
+			#	relationships in which the reached nodes participate. Reached
+			#	nodes without relationships come back with a single NULL row.
 			nameMask = ','.join('?'*len(nex))
-			res = [(str)(r[0]) for r in c.execute("SELECT ID FROM NODES WHERE NAME IN (%s)" % nameMask,nex).fetchall()]
-
-			if len(res):
-
-				# Get all relationships in which the existing nodes participate
-				rel = c.execute("""
-						SELECT
-							LFT.NAME,
-							RGT.NAME,
-							R.NAME,
-							K.WEIGHT
-						FROM
-							RELATIONSHIPS K,
-							NODES LFT,
-							NODES RGT,
-							NODES R
-						WHERE
-							LFT.ID = K.NODELEFT
-							AND RGT.ID = K.NODERIGHT
-							AND R.ID = K.RELATION
-							AND LFT.ID IN (%s)
-					""" % (nameMask),res).fetchall()
-
-				# Load the relationships into the graph
-				for tup in rel:
-					self.registry.relate((tup[1],tup[3]),tup[0],tup[2],"")
-
-				# After all the loading is done, set all input nodes to loaded
-				self.registry.get(name,load=0).setLoaded(True)
-		return self.registry.get(name,load=0)
-	
+			relMask = ','.join('?'*len(relations))
+			rel = c.execute("""
+					WITH RECURSIVE
+						HOOD(ID,DEPTH) AS (
+							SELECT ID, 0 FROM NODES WHERE NAME IN (%s)
+							UNION
+							SELECT
+								K.NODERIGHT,
+								H.DEPTH + 1
+							FROM
+								HOOD H,
+								RELATIONSHIPS K
+							WHERE
+								K.NODELEFT = H.ID
+								AND H.DEPTH < ?
+								%s
+						)
+					SELECT
+						LFT.NAME,
+						RGT.NAME,
+						R.NAME,
+						K.WEIGHT,
+						H.DEPTH
+					FROM
+						(SELECT ID, MIN(DEPTH) AS DEPTH FROM HOOD GROUP BY ID) H
+						JOIN NODES LFT ON LFT.ID = H.ID
+						LEFT JOIN RELATIONSHIPS K ON K.NODELEFT = H.ID
+						LEFT JOIN NODES RGT ON RGT.ID = K.NODERIGHT
+						LEFT JOIN NODES R ON R.ID = K.RELATION
+				""" % (
+					nameMask,
+					"AND K.RELATION IN (SELECT ID FROM NODES WHERE NAME IN (%s))" % relMask if relations else ""
+				),[n.lower() for n in nex] + [depth] + relations).fetchall()
+			c.close()
+
+			# Load the relationships into the graph, skipping those of nodes
+			#	that were already loaded. They are already stored, so they
+			#	must not be tracked as changes. Threads may have loaded some
+			#	of the nodes meanwhile; that is only checked under the lock.
+			#	Every name is resolved to its Node once, and the edges are
+			#	related in a single batch.
+			with self.registry.lock.write():
+				tracking = self.tracking
+				self.tracking = False
+				try:
+					nodes = {}
+					def resolve(name):
+						n = nodes.get(name)
+						if n is None:
+							n = nodes[name] = self.registry._add(name)
+						return n
+
+					reached = {}
+					batch = []
+					for tup in rel:
+						if tup[0] not in reached:
+							node = self.registry.lookup.get(tup[0])
+							reached[tup[0]] = not (node and node.loaded)
+							node = resolve(tup[0])
+
+							# Nodes `hop` hops away have their neighborhood loaded
+							#	`depth - hop` hops deep
+							if depth > tup[4] and not relations:
+								self.depths[node] = max(self.depths.get(node,0),depth - tup[4])
+						if reached[tup[0]] and tup[1] is not None:
+							batch.append(([(resolve(tup[1]),tup[3])],[(nodes[tup[0]],1)],resolve(tup[2]),None))
+					self.registry.relateBatch(batch)
+				finally:
+					self.tracking = tracking
+
+				# After all the loading is done, set all input and reached nodes to
+				#	loaded
+				loaded = self.registry.get(nex + list(reached),load=0)
+				loaded.setLoaded(True)
+				for n in loaded.index:
+					self.registry.touch(n)
+
+				# Make room for them in out-of-core mode, keeping the nodes
+				#	asked for; those reached on the way may be evicted
+				self.registry.use(loaded.index)
+				self.registry.evict(self.registry.get(nex,load=0).index)
+				if start:
+					PROFILER.count('sql.statements')
+					PROFILER.record('dbc.load',start,len(rel))
+		out = self.registry.get(name,load=0)
+		self.registry.use(out.index)
+		return out
+
 	def convert(self,filename):
 
 		"""
@@ -0,0 +1,171 @@
+from nodes import *
+from common import *
+
+class DBQuery(object):
+
+	"""
+	A chain of rel(), limit(), exclude() and top() calls that is run by the
+	connected database instead of the in-memory registry.
+
+	The chain compiles to a single SQL statement in which every step is a
+	common table expression over the previous one: weights are multiplied
+	through each relationship and summed per node by SQLite, just like
+	NodeList.rel() does (as if ACCUMULATE_RELATIONSHIPS were True). Only
+	the nodes of the final result are brought into the registry, and none of
+	them are loaded.
+
+	Queries are immutable; every method returns a new DBQuery. Iterating a
+	query runs it.
+	"""
+
+	def __init__(self,registry,seeds,steps=None):
+		super(DBQuery, self).__init__()
+		self.registry = registry
+		self.seeds = seeds
+		self.steps = steps or []
+
+	def __str__(self):
+		return self.compile()[0]
+	__repr__ = __str__
+
+	def __iter__(self):
+		for n in self.run():
+			yield n
+
+	def _then(self,op,arg):
+		return DBQuery(self.registry,self.seeds,self.steps + [(op,arg)])
+
+	def rel(self,name=None):
+
+		"""
+		Get all nodes related to the nodes within this query by the given
+		`name` (a string or list of strings), or by any relation if no name
+		is given
+		"""
+
+		return self._then('rel',[n.lower() for n in enlist(name)] if name else [])
+
+	def limit(self,nodes):
+
+		"""
+		Keep only the given `nodes`, which may be a DBQuery, a NodeList, or a
+		list of (any combination of) strings, Nodes and NodeTuples
+		"""
+
+		return self._then('limit',nodes)
+
+	def exclude(self,nodes):
+
+		"""
+		Remove the given `nodes`, which may be anything accepted by limit()
+		"""
+
+		return self._then('exclude',nodes)
+
+	def top(self,n):
+
+		"""
+		Keep only the `n` heaviest nodes
+		"""
+
+		return self._then('top',n)
+
+	def _nodeSet(self,nodes,params):
+
+		"""
+		Private helper for compile(), returns a SELECT of the IDs of the given
+		`nodes` and adds its parameters to `params`
+		"""
+
+		if type(nodes) == DBQuery:
+			sql,sub = nodes.compile()
+			params += sub
+			return "SELECT ID FROM (%s)" % sql
+		names = []
+		for n in enlist(nodes):
+			if type(n) == NodeList:
+				names += [t.node.name for t in n]
+			elif type(n) == NodeTuple:
+				names.append(n.node.name)
+			elif type(n) == Node:
+				names.append(n.name)
+			elif type(n) == str:
+				names.append(n)
+		params += [n.lower() for n in names]
+		return "SELECT ID FROM NODES WHERE NAME IN (%s)" % ','.join('?'*len(names))
+
+	def compile(self):
+
+		"""
+		Returns the SQL statement and its parameters for this query. The
+		statement selects the ID, name and weight of every node in the
+		result, heaviest first.
+		"""
+
+		params = []
+		if self.seeds:
+			seeds = "VALUES %s" % ','.join(['(?,?)']*len(self.seeds))
+			for s in self.seeds:
+				params += [s[0].lower(),s[1]]
+		else:
+			seeds = "SELECT NULL, NULL WHERE 0"
+
+		ctes = [
+			"S(NAME,W) AS (%s)" % seeds,
+			"""F0(ID,W) AS (
+				SELECT N.ID, SUM(S.W) FROM S, NODES N WHERE N.NAME = S.NAME GROUP BY N.ID
+			)"""
+		]
+		for i,step in enumerate(self.steps,1):
+			op,arg = step
+			if op == 'rel':
+				where = ""
+				if arg:
+					where = "AND K.RELATION IN (SELECT ID FROM NODES WHERE NAME IN (%s))" % ','.join('?'*len(arg))
+					params += arg
+				ctes.append("""F%d(ID,W) AS (
+					SELECT K.NODERIGHT, SUM(F.W * K.WEIGHT)
+					FROM F%d F, RELATIONSHIPS K
+					WHERE K.NODELEFT = F.ID %s
+					GROUP BY K.NODERIGHT
+				)""" % (i,i-1,where))
+			elif op in ('limit','exclude'):
+				ctes.append("F%d(ID,W) AS (SELECT ID, W FROM F%d WHERE ID %s (%s))" % (
+					i,i-1,"IN" if op == 'limit' else "NOT IN",self._nodeSet(arg,params)))
+			elif op == 'top':
+				ctes.append("F%d(ID,W) AS (SELECT ID, W FROM F%d ORDER BY W DESC, ID LIMIT ?)" % (i,i-1))
+				params.append(arg)
+
+		sql = """
+			WITH
+				%s
+			SELECT
+				N.ID,
+				N.NAME,
+				F.W
+			FROM
+				F%d F,
+				NODES N
+			WHERE
+				N.ID = F.ID
+			ORDER BY
+				F.W DESC,
+				N.ID
+		""" % (',\n\t\t\t\t'.join(ctes),len(self.steps))
+		return (sql,params)
+
+	def run(self):
+
+		"""
+		Run the query against the connected database, returns a NodeList
+		"""
+
+		dbc = self.registry.dbc
+		if not dbc.isConnected():
+			raise Exception('DBQuery: No database connected')
+		sql,params = self.compile()
+		c = dbc.connection.cursor()
+		rows = c.execute(sql,params).fetchall()
+		c.close()
+		nodes = dbc.stored([r[1] for r in rows])
+		return NodeList.fromTuples([NodeTuple(nodes[i],rows[i][2]) for i in range(len(rows))],self.registry)
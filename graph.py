@@ -1,11 +1,21 @@
+import os
 from nodes import *
 from nodeRegistry import NodeRegistry
+from compactRegistry import CompactRegistry
+from NodeRegistrySettings import NodeRegistrySettings
+from dbquery import DBQuery
+from sparse import SparseGraph
+from paths import PathFinder
+from profiler import Trace
+import snapshot
 
 class Graph(object):
 	"""docstring for Graph"""
-	def __init__(self):
+	def __init__(self,settings=None):
 		super(Graph, self).__init__()
-		self.registry = NodeRegistry(self)
+		settings = settings or NodeRegistrySettings()
+		engine = CompactRegistry if settings.COMPACT_STORAGE else NodeRegistry
+		self.registry = engine(self,settings)
 		self.settings = self.registry.settings
 
 	# Retrieval methods
@@ -15,15 +25,90 @@ class Graph(object):
 	def rel(self,name):
 		return self.registry.rel(name)
 
+	def search(self,prefix,limit=10,fuzzy=False):
+		return self.registry.search(prefix,limit,fuzzy)
+
+	def query(self,name):
+		return DBQuery(self.registry,[(n,1) for n in enlist(name)])
+
+	def path(self,src,dst,relations=None,cost=None,heuristic=None,bidirectional=False,maxDepth=None,reverse=None):
+		return PathFinder(self.registry).find(src,dst,relations,cost,heuristic,bidirectional,maxDepth,reverse)
+
+	def sparse(self):
+		return SparseGraph(self.registry)
+
+	def cacheStats(self):
+		return self.registry.cacheStats()
+
+	# Profiling methods
+	def profile(self,enabled=True):
+		PROFILER.enabled = enabled
+
+	def stats(self,reset=False):
+
+		"""
+		Returns a snapshot of the profiler's `counters` and cumulative
+		`timers` (in seconds), along with the rel() cache statistics. The
+		profiler must be turned on with profile() to collect them, and is
+		shared by all Graphs. Resets the counters and timers if `reset` is
+		True.
+		"""
+
+		out = PROFILER.snapshot(reset)
+		out['cache'] = self.cacheStats()
+		return out
+
+	def resetStats(self):
+		PROFILER.reset()
+
+	def trace(self,name=None):
+
+		"""
+		Returns a context manager which profiles the queries run within it,
+		recording each rel() hop with its frontier sizes and time. See Trace.
+		"""
+
+		return Trace(PROFILER,name)
+
 	def all(self):
-		return NodeList((list)(self.registry.registry.keys()),self.registry);
+		return NodeList.fromNodes(self.registry.registry,self.registry)
 
 	# Population methods
 	def add(self,name,data=None):
 		return self.registry.add(name,data)
 
-	def read(self,filename):
-		return self.registry.reader.read(filename)
+	def read(self,filename,workers=1):
+		if type(filename) == str and workers == 1 and not os.path.isdir(filename):
+			return self.registry.reader.read(filename)
+		return self.registry.reader.readAll(filename,workers)
+
+	def importEdges(self,source,database=False):
+		return self.registry.reader.importEdges(source,database)
+	import_edges = importEdges
+
+	def exportEdges(self,database=None):
+
+		"""
+		Yields every relationship of the graph as a (left, relation, right,
+		weight) tuple of names, as taken by importEdges(); for instance,
+		csv.writer(f).writerows(g.exportEdges()) writes them to a CSV file.
+
+		Relationships are read from the connected database if `database` is
+		True, which is the default when one is connected; pending changes
+		are dumped first. They are streamed from a cursor, so memory use
+		does not grow with their number. Otherwise, the relationships in
+		memory are exported, except for those by private relations.
+		"""
+
+		dbc = self.registry.dbc
+		if database is None:
+			database = dbc.isConnected()
+		if database:
+			if dbc.isDirty():
+				dbc.dump()
+			return dbc.exportEdges()
+		return ((n.name,r.name,t.name,w) for n,r,t,w in dbc._allEdges())
+	export_edges = exportEdges
 
 	def eval(self,exp):
 		return self.registry.reader.eval(exp)
@@ -37,6 +122,13 @@ class Graph(object):
 	def relate(self,left,right,leftward,rightward):
 		return self.registry.relate(left,right,leftward,rightward)
 
+	def relateMany(self,edges):
+		return self.registry.relateMany(edges)
+	relate_many = relateMany
+
+	def compact(self):
+		return self.registry.compact()
+
 	# Persistence methods
 	def connect(self,filename):
 		return self.registry.dbc.connect(filename)
@@ -44,5 +136,34 @@ class Graph(object):
 	def dump(self):
 		return self.registry.dbc.dump()
 
+	def load(self,name,depth=None,relations=None):
+		return self.registry.dbc.load(name,depth,relations)
+
 	def initializeDB(self,imsure=0):
-		return self.registry.dbc.initialize(imsure)
\ No newline at end of file
+		return self.registry.dbc.initialize(imsure)
+
+	def saveSnapshot(self,path):
+
+		"""
+		Writes all of the nodes and relationships of the graph to a snapshot
+		file at `path`, which openSnapshot() opens instantly
+		"""
+
+		return snapshot.save(self.registry,path)
+	save_snapshot = saveSnapshot
+
+	@classmethod
+	def openSnapshot(cls,path,settings=None):
+
+		"""
+		Returns a new Graph serving the snapshot file at `path`, which is
+		memory-mapped rather than read: nodes and relationships are read from
+		it as they are used, and processes opening the same file share its
+		memory. The Graph uses the CompactRegistry storage engine.
+		"""
+
+		g = cls(settings)
+		g.registry = snapshot.SnapshotRegistry(g,g.settings,path)
+		g.settings = g.registry.settings
+		return g
+	open_snapshot = openSnapshot
\ No newline at end of file
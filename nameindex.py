@@ -0,0 +1,120 @@
+import heapq
+from bisect import bisect_left
+from concurrency import NULL_LOCK
+
+def trigrams(key):
+
+	"""
+	Returns the set of trigrams of `key`, padded with two spaces in front and
+	one behind so that short keys and the start of keys weigh more
+	"""
+
+	key = '  ' + key + ' '
+	return set([key[i:i+3] for i in range(len(key) - 2)])
+
+def rank(scores,query,limit):
+
+	"""
+	Returns the `limit` best (key, score) pairs of the `scores` dict of fuzzy
+	matches of `query`: highest score first, then closest in length
+	"""
+
+	return heapq.nsmallest(limit,scores.items(),key=lambda i: (-i[1],abs(len(i[0]) - len(query)),i[0]))
+
+def upper(prefix):
+
+	"""
+	Returns the smallest string greater than all strings starting with
+	`prefix`, or None if there is none
+	"""
+
+	while prefix and ord(prefix[-1]) == 0x10ffff:
+		prefix = prefix[:-1]
+	return prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else None
+
+
+class NameIndex(object):
+
+	"""
+	Type-ahead index over the keys (lowercased names) of the nodes of a
+	registry.
+
+	The prefix index is a sorted list of the keys, searched by bisection.
+	It is built from `keys()` when it is first searched; keys added since
+	are buffered in `pending` and merged into it on the next search. The
+	trigram index, mapping every trigram to the keys that contain it, is
+	built the same way on the first fuzzy match, and then kept up to date.
+
+	A `mutex` (such as a threading.Lock) may be given to guard the indices
+	when they are searched from several threads.
+	"""
+
+	def __init__(self, keys, mutex=None):
+		super(NameIndex, self).__init__()
+		self.keys = keys
+		self.mutex = mutex or NULL_LOCK
+		self.sorted = None
+		self.pending = []
+		self.grams = None
+
+	def add(self,key):
+
+		"""
+		Records a new `key`, if the indices were built
+		"""
+
+		if self.sorted is not None:
+			self.pending.append(key)
+		if self.grams is not None:
+			for g in trigrams(key):
+				keys = self.grams.get(g)
+				if keys is None:
+					self.grams[g] = [key]
+				else:
+					keys.append(key)
+
+	def prefix(self,prefix,limit):
+
+		"""
+		Returns the first `limit` keys starting with `prefix`, in order
+		"""
+
+		with self.mutex:
+			if self.sorted is None:
+				self.sorted = sorted(self.keys())
+				self.pending = []
+			elif self.pending:
+				self.sorted.extend(self.pending)
+				self.sorted.sort()
+				self.pending = []
+			keys = self.sorted
+		out = []
+		i = bisect_left(keys,prefix)
+		while i < len(keys) and len(out) < limit and keys[i].startswith(prefix):
+			out.append(keys[i])
+			i += 1
+		return out
+
+	def match(self,query,limit):
+
+		"""
+		Returns the `limit` keys sharing the most trigrams with `query`, as
+		(key, number of trigrams shared) pairs
+		"""
+
+		with self.mutex:
+			if self.grams is None:
+				grams = {}
+				for key in self.keys():
+					for g in trigrams(key):
+						keys = grams.get(g)
+						if keys is None:
+							grams[g] = [key]
+						else:
+							keys.append(key)
+				self.grams = grams
+		scores = {}
+		for g in trigrams(query):
+			for key in self.grams.get(g,()):
+				scores[key] = scores.get(key,0) + 1
+		return rank(scores,query,limit)
@@ -1,8 +1,14 @@
+import sys
+import threading
+from collections import OrderedDict
 from nodes import *
 from common import *
 from reader import *
 from dbc import *
 from NodeRegistrySettings import *
+from relcache import RelCache
+from concurrency import RWLock, NULL_LOCK
+from nameindex import NameIndex, rank
 
 class NodeRegistry(object):
 
@@ -14,6 +20,14 @@ class NodeRegistry(object):
 		super(NodeRegistry, self).__init__()
 		self.lookup = {}
 		self.registry = {}
+		self.versions = {}
+		self.cache = None
+
+		# Reverse indices: the weighted participants of each relation (the
+		# nodes it denotes), and the source nodes of each node's incoming
+		# edges by relation
+		self.participants = {}
+		self.incoming = {}
 		self.parent = graph
 		self.dbc = DBC(self)
 		self.reader = Reader(self)
@@ -22,6 +36,19 @@ class NodeRegistry(object):
 		else:
 			self.settings = NodeRegistrySettings()
 
+		# Readers-writer lock guarding the registry and its indices when the
+		# graph is shared between threads
+		self.lock = RWLock() if self.settings.THREAD_SAFE else NULL_LOCK
+
+		# Loaded nodes in least recently used order, kept for out-of-core
+		# mode (see MAX_LOADED_NODES)
+		self.resident = OrderedDict()
+		self.pinned = {}
+		self.residentLock = threading.Lock() if self.settings.THREAD_SAFE else NULL_LOCK
+
+		# Prefix and trigram indices of the keys of `lookup`, for search()
+		self.names = NameIndex(lambda: self.lookup.keys(),threading.Lock() if self.settings.THREAD_SAFE else None)
+
 	def _add(self,name,data=None):
 
 		"""
@@ -30,17 +57,238 @@ class NodeRegistry(object):
 
 		if type(name) == str:
 			lname = name.lower()
-			if lname not in self.lookup:
+			n = self.lookup.get(lname)
+			if n is None:
+				lname = sys.intern(lname)
 				n = self.lookup[lname] = Node(name,data)
-				self.registry[n] = {}
-				return n
-			else:
-				return self.lookup[lname]
+				self._register(n)
+				self.names.add(lname)
+				self.dbc.trackNode(n)
+			return n
 		elif type(name) == Node:
 			return name
 		else:
 			return None
 
+	def _register(self,node):
+
+		"""
+		Private helper for _add(), allocates the storage for a new node
+		"""
+
+		self.registry[node] = {}
+
+	def _link(self,node,relation,relative,weight):
+
+		"""
+		Private helper for relate(), stores a single directed edge from `node`
+		to `relative` under `relation`, all three being Nodes. Returns True if
+		the edge was added or given more weight.
+		"""
+
+		rels = self.registry[node]
+		relatives = rels.get(relation)
+		if relatives is None:
+			relatives = rels[relation] = NodeList([],self)
+		tup = relatives.index.get(relative)
+		if tup is None:
+			relatives.index[relative] = NodeTuple(relative,weight)
+		elif self.settings.ACCUMULATE_RELATIONSHIPS:
+			tup.weight += weight
+		else:
+			return False
+		relatives.sorted = False
+		return True
+
+	def _weight(self,node,relation,relative):
+
+		"""
+		Private helper, returns the weight of the edge from `node` to
+		`relative` under `relation`
+		"""
+
+		return self.registry[node][relation].index[relative].weight
+
+	def _participate(self,relation,node):
+
+		"""
+		Private helper for _relate(), records `node` as a participant of
+		`relation` in the relation index
+		"""
+
+		members = self.participants.get(relation)
+		if members is None:
+			members = self.participants[relation] = {}
+		if node not in members:
+			members[node] = 1
+		elif self.settings.ACCUMULATE_RELATIONSHIPS:
+			members[node] += 1
+
+	def _index(self,node,relation,relative):
+
+		"""
+		Private helper for _relate(), records the edge from `node` to
+		`relative` under `relation` in the incoming edge index
+		"""
+
+		if self.settings.INDEX_INCOMING:
+			edges = self.incoming.get(relative)
+			if edges is None:
+				edges = self.incoming[relative] = {}
+			sources = edges.get(relation)
+			if sources is None:
+				sources = edges[relation] = set()
+			sources.add(node)
+
+	def relCache(self):
+
+		"""
+		Returns the RelCache of this registry, creating or resizing it to match
+		the REL_CACHE_SIZE setting, or None if caching is disabled
+		"""
+
+		size = self.settings.REL_CACHE_SIZE
+		if not size:
+			self.cache = None
+		elif self.cache is None:
+			self.cache = RelCache(size,threading.Lock() if self.settings.THREAD_SAFE else None)
+		else:
+			self.cache.size = size
+		return self.cache
+
+	def cacheStats(self):
+		return self.cache.stats() if self.cache else None
+
+	def touch(self,node):
+
+		"""
+		Bumps the version of `node`, invalidating cached rel() results seeded
+		from it. Versions are only kept while caching is enabled.
+		"""
+
+		if self.cache is not None:
+			self.versions[node] = self.versions.get(node,0) + 1
+
+	def use(self,nodes):
+
+		"""
+		Records that the given loaded Nodes were used, for out-of-core mode
+		"""
+
+		if self.settings.MAX_LOADED_NODES:
+			resident = self.resident
+			with self.residentLock:
+				for n in nodes:
+					if n.loaded:
+						resident[n] = True
+						resident.move_to_end(n)
+
+	def pin(self,nodes):
+
+		"""
+		Keeps the given Nodes from being evicted until they are unpinned, for
+		out-of-core mode. Pins are counted, so that nested pins of the same
+		node need as many unpins.
+		"""
+
+		if self.settings.MAX_LOADED_NODES:
+			with self.residentLock:
+				for n in nodes:
+					self.pinned[n] = self.pinned.get(n,0) + 1
+
+	def unpin(self,nodes):
+		if self.settings.MAX_LOADED_NODES:
+			with self.residentLock:
+				for n in nodes:
+					if self.pinned[n] > 1:
+						self.pinned[n] -= 1
+					else:
+						del self.pinned[n]
+
+	def evict(self,keep=()):
+
+		"""
+		Evicts the relationships of the least recently used loaded nodes
+		beyond the MAX_LOADED_NODES setting, if a database is connected,
+		other than those in `keep` and those pinned (see pin()). Unsaved
+		changes are dumped first.
+
+		returns the number of nodes evicted
+		"""
+
+		limit = self.settings.MAX_LOADED_NODES
+		if not limit or len(self.resident) <= limit or not self.dbc.isConnected():
+			return 0
+		with self.lock.write():
+			if self.dbc.isDirty():
+				self.dbc.dump()
+			evicted = []
+			with self.residentLock:
+				excess = len(self.resident) - (limit - limit // 10)
+				for node in self.resident:
+					if len(evicted) >= excess:
+						break
+					if node not in keep and node not in self.pinned:
+						evicted.append(node)
+				for node in evicted:
+					del self.resident[node]
+			self._drop(evicted)
+			for n in evicted:
+				n.loaded = False
+				self.dbc.depths.pop(n,None)
+				self.touch(n)
+		return len(evicted)
+
+	def _drop(self,nodes):
+
+		"""
+		Private helper for evict(), removes the relationships of the given
+		Nodes from storage and from the reverse indices
+		"""
+
+		for node in nodes:
+			rels = self.registry[node]
+			for relation,relatives in rels.items():
+				for t in relatives.index.values():
+					self._unindex(node,relation,t.node)
+			self.registry[node] = {}
+
+	def _unindex(self,node,relation,relative):
+
+		"""
+		Private helper for _drop(), the reverse of _participate() and
+		_index() for the edge from `node` to `relative` under `relation` as
+		it was loaded: `relative` participates in `relation` once more for
+		every such edge when ACCUMULATE_RELATIONSHIPS is set, and otherwise
+		until the last edge to it by `relation` is dropped.
+		"""
+
+		sources = None
+		if self.settings.INDEX_INCOMING:
+			edges = self.incoming.get(relative)
+			sources = edges.get(relation) if edges else None
+			if sources is not None:
+				sources.discard(node)
+				if not sources:
+					del edges[relation]
+		members = self.participants.get(relation)
+		if members and relative in members:
+			if self.settings.ACCUMULATE_RELATIONSHIPS:
+				members[relative] -= 1
+				if members[relative] <= 0:
+					del members[relative]
+			elif sources is not None and not sources:
+				del members[relative]
+
+	def compact(self):
+
+		"""
+		Compacts the storage of the graph. Does nothing for the default
+		storage engine; see CompactRegistry.
+		"""
+
+		return None
+
 	def add(self,name,data=None):
 
 		"""
@@ -52,7 +300,8 @@ class NodeRegistry(object):
 		returns NodeList contaning newly created Node
 		"""
 
-		return NodeList([self._add(name,data)],self)
+		with self.lock.write():
+			return NodeList.fromNodes([self._add(name,data)],self)
 
 	def addAll(self,names,data=None):
 
@@ -68,7 +317,8 @@ class NodeRegistry(object):
 
 		if type(names) == str:
 			return self.add(names,data)
-		return NodeList([self._add(n) for n in names],self)
+		with self.lock.write():
+			return NodeList.fromNodes([self._add(n) for n in names],self)
 
 
 	def get(self,name,create=0,load=1,data=None):
@@ -95,20 +345,109 @@ class NodeRegistry(object):
 			if create:
 				return self.addAll(name,data)
 			else:
-				return NodeList([self.lookup[n.lower()] for n in name if n.lower() in self.lookup],self)
+				found = map(self.lookup.get,[n.lower() for n in name])
+				return NodeList.fromNodes([n for n in found if n is not None],self)
+
+	def _prefix(self,prefix,limit):
+
+		"""
+		Private helper for search(), returns the first `limit` keys of nodes
+		in memory starting with `prefix`, in order
+		"""
+
+		return self.names.prefix(prefix,limit)
+
+	def search(self,prefix,limit=10,fuzzy=False):
+
+		"""
+		Finds nodes by name, for type-ahead search. Case is ignored.
+
+		`limit` is the maximum number of nodes to find
+		If `fuzzy` is True, nodes are found by the number of trigrams their
+			names share with `prefix` instead, which tolerates typos. This
+			requires the FUZZY_INDEX setting.
+
+		When connected, the nodes stored in the database are searched as
+		well, with its indices; those found that are not in memory yet are
+		added, but not loaded.
+
+		returns NodeList of the nodes found, in alphabetical order for prefix
+		matches (all weighing 1), or with the number of trigrams shared as
+		their weight for fuzzy matches
+		"""
+
+		if fuzzy and not self.settings.FUZZY_INDEX:
+			raise Exception('NodeRegistry: Fuzzy search requires the FUZZY_INDEX setting')
+		key = prefix.lower()
+		with self.lock.read():
+			if fuzzy:
+				found = self.names.match(key,limit)
+			else:
+				found = self._prefix(key,limit)
+		if self.dbc.isConnected():
+			if fuzzy:
+				scores = dict(self.dbc.match(key,limit))
+				scores.update(found)
+				found = rank(scores,key,limit)
+			else:
+				found = sorted(set(found).union(self.dbc.prefix(key,limit)))[:limit]
+		if not fuzzy:
+			found = [(k,1) for k in found]
+		if self.dbc.isConnected():
+			nodes = self.dbc.stored([k for k,w in found])
+		else:
+			nodes = [self.lookup[k] for k,w in found]
+		return NodeList.fromTuples([NodeTuple(n,f[1]) for n,f in zip(nodes,found)],self)
 
 
-	def rel(self,name):
+	def rel(self,name,load=1):
 
 		"""
 		Gets all nodes related by the given name(s)
 
 		`name` must be a string or list of strings
+		If `load` is True, the relations and the returned nodes are loaded
+			from the connected database, if any
 
 		returns NodeList
 		"""
-		return self.get(name).rel('_connects')
-		
+
+		out = NodeList([],self)
+		relations = self.get(name,load=load).index
+		with self.lock.read():
+			for relation in relations:
+				members = self.participants.get(relation,{})
+				out._insert([NodeTuple(n,w) for n,w in members.items()],True)
+		return out.load() if load else out
+
+	def relatedBy(self,node,name=None):
+
+		"""
+		Gets all nodes with an edge to `node` by the given name(s), weighted
+		by the weight of that edge; for instance, relatedBy(bob,'friends')
+		are all the nodes that have `bob` as a friend. Only the edges that
+		are in memory are known.
+
+		`node` must be a Node
+		`name` may be a string or list of strings; all relations are used if
+			no name is given
+
+		Raises an Exception if the INDEX_INCOMING setting is off
+
+		returns list of (Node, weight) tuples
+		"""
+
+		if not self.settings.INDEX_INCOMING:
+			raise Exception('NodeRegistry: relatedBy() requires the INDEX_INCOMING setting')
+		with self.lock.read():
+			edges = self.incoming.get(node,{})
+			relations = [n.node for n in self.get(name,load=0)] if name else list(edges)
+			out = []
+			for relation in relations:
+				for src in edges.get(relation,()):
+					out.append((src,self._weight(src,relation,node)))
+		return out
+
 
 	def relate(self,left,right,leftward,rightward):
 
@@ -125,27 +464,92 @@ class NodeRegistry(object):
 		returns None
 		"""
 
-		left = tuplate(left,create=1,load=0,registry=self)
-		right = tuplate(right,create=1,load=0,registry=self)
-		addLeft = self.settings.MANAGE_CONNECTIONS and leftward and leftward[0] != "_"
-		addRight = self.settings.MANAGE_CONNECTIONS and rightward and rightward[0] != "_"
-		leftward = None if not leftward else self.get(leftward,create=1,load=0).first()
-		rightward = None if not rightward else self.get(rightward,create=1,load=0).first()
-		acc = self.settings.ACCUMULATE_RELATIONSHIPS
+		with self.lock.write():
+			left = tuplate(left,create=1,load=0,registry=self)
+			right = tuplate(right,create=1,load=0,registry=self)
+			leftward = None if not leftward else self.get(leftward,create=1,load=0).first()
+			rightward = None if not rightward else self.get(rightward,create=1,load=0).first()
+			self._relate(left,right,leftward,rightward)
+
+	def relateBatch(self,batch):
+
+		"""
+		Relates many groups of nodes at once, resolving each distinct name
+		only once for the whole batch.
+
+		`batch` may be any iterable of (left, right, leftward, rightward)
+			tuples, where `left` and `right` are lists of (name, weight)
+			tuples and `leftward` and `rightward` are relation names, as in
+			relate()
+
+		returns None
+		"""
+
+		nodes = {}
+		def resolve(name):
+			n = nodes.get(name)
+			if n is None:
+				n = nodes[name] = self._add(name)
+			return n
+
+		with self.lock.write():
+			for left,right,leftward,rightward in batch:
+				self._relate(
+					[NodeTuple(resolve(n),w) for n,w in left],
+					[NodeTuple(resolve(n),w) for n,w in right],
+					resolve(leftward) if leftward else None,
+					resolve(rightward) if rightward else None
+				)
+
+	def relateMany(self,edges):
+
+		"""
+		Relates many pairs of nodes in a single pass, with the same results
+		as calling relate() for each of them. This is relateBatch() for
+		records of one pair each, which suits edge lists such as those read
+		from CSV files; relateBatch() also relates groups of nodes at once.
+
+		`edges` may be any iterable of (left, leftward, rightward, right,
+			weight) records, each standing for
+			relate((left,weight),(right,weight),leftward,rightward): `left`
+			and `right` are names (or Nodes), `leftward` and `rightward`
+			relation names (or Nodes), either of which may be empty
+
+		returns None
+		"""
+
+		def pairs():
+			for left,leftward,rightward,right,weight in edges:
+				if type(weight) != int:
+					enforceType(weight,int,'Tuple weight must be an integer ({0} was provided)')
+				yield ([(left,weight)],[(right,weight)],leftward,rightward)
+
+		self.relateBatch(pairs())
+
+	def _relate(self,left,right,leftward,rightward):
+
+		"""
+		Private helper for relate() and relateBatch(), relates every node of
+		`left` to every node of `right`; `left` and `right` must be lists of
+		NodeTuples, `leftward` and `rightward` Nodes or None
+		"""
+
+		addLeft = self.settings.MANAGE_CONNECTIONS and leftward and leftward.name[0] != "_"
+		addRight = self.settings.MANAGE_CONNECTIONS and rightward and rightward.name[0] != "_"
 
 		for l in left:
 			if leftward and addLeft:
-				self.relate(leftward,l.node,"","_connects")
+				self._participate(leftward,l.node)
 			for r in right:
 				if rightward:
 					if addRight:
-						self.relate(rightward,r.node,"","_connects")
-					rnew = rightward not in self.registry[l.node]
-					if rnew:
-						self.registry[l.node][rightward] = NodeList([],self)
-					self.registry[l.node][rightward].append((r.node,r.weight))
+						self._participate(rightward,r.node)
+					if self._link(l.node,rightward,r.node,r.weight):
+						self._index(l.node,rightward,r.node)
+						self.touch(l.node)
+						self.dbc.trackEdge(l.node,rightward,r.node,r.weight)
 				if leftward:
-					lnew = leftward not in self.registry[r.node]
-					if lnew:
-						self.registry[r.node][leftward] = NodeList([],self)
-					self.registry[r.node][leftward].append((l.node,l.weight))
\ No newline at end of file
+					if self._link(r.node,leftward,l.node,l.weight):
+						self._index(r.node,leftward,l.node)
+						self.touch(r.node)
+						self.dbc.trackEdge(r.node,leftward,l.node,l.weight)
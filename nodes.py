@@ -1,4 +1,7 @@
+import heapq
+import time
 from common import *
+from profiler import PROFILER
 
 class Node(object):
 	"""
@@ -8,7 +11,8 @@ class Node(object):
 	not bound to a single Graph (they are referenced in NodeTuples, which
 	compose NodeLists, which are associated with a Graph's NodeRegistry).
 	A node must have a name, and may optionally contain data, which may be of
-	any type.
+	any type. The CompactRegistry storage engine gives the nodes added to it
+	a dense integer `id`.
 	"""
 	def __init__(self, name, data):
 		super(Node, self).__init__()
@@ -32,29 +36,110 @@ class NodeList(object):
 
 	def __init__(self, nodes, registry):
 		super(NodeList, self).__init__()
-		self.nodes = tuplate(nodes)
 		self.parent = registry
-		self.sorted = False
+		self.index = {}
+		self.ranked = []
+		self.sorted = True
+		if nodes:
+			self._insert(nodes.index.values() if type(nodes) == NodeList else tuplate(nodes),True)
+
+	@classmethod
+	def fromTuples(cls,tuples,registry):
+
+		"""
+		Builds a NodeList of the given NodeTuples, which must already refer to
+		Nodes, without converting them first. The NodeTuples are copied, not
+		shared.
+		"""
+
+		out = cls([],registry)
+		out._insert(tuples,True)
+		return out
+
+	@classmethod
+	def fromNodes(cls,nodes,registry,weight=1):
+
+		"""
+		Builds a NodeList of the given Nodes, each with the given `weight`,
+		without converting them first
+		"""
+
+		out = cls([],registry)
+		index = out.index
+		for n in nodes:
+			tup = index.get(n)
+			if tup is None:
+				index[n] = NodeTuple(n,weight)
+			else:
+				tup.weight += weight
+		out.sorted = not index
+		return out
 
 	def __str__(self):
 		return '[{0}]'.format(', '.join([n.node.name for n in self.nodes]))
 	__repr__ = __str__
 
 	def __iter__(self):
-		for n in self.sort().nodes:
+		for n in self.nodes:
 			yield n
 
+	def __len__(self):
+		return len(self.index)
+
 	def __mul__(self,coefficient):
-		out = NodeList(self.nodes,self.parent)
-		for n in out:
-			n.weight *= coefficient
+		out = NodeList.fromTuples(self.nodes,self.parent)
+		out *= coefficient
 		return out
 
+	def __and__(self,nodes):
+		return self.intersect(nodes)
+
+	def __or__(self,nodes):
+		return self.union(nodes)
+
+	def __sub__(self,nodes):
+		return self.exclude(nodes)
+
 	def __imul__(self,coefficient):
-		for n in self:
+		for n in self.index.values():
 			n.weight *= coefficient
+		if coefficient <= 0:
+			self.sorted = False
 		return self
 
+	@property
+	def nodes(self):
+
+		"""
+		The contained NodeTuples, consolidated and sorted by weight (highest
+		first). The sorted view is cached until the list changes.
+		"""
+
+		return self.sort().ranked
+
+	def _insert(self,tuples,accumulate,coefficient=1):
+
+		"""
+		Private helper for the constructor, append() and rel(). Adds each of
+		the given NodeTuples to the node index, adding weight to nodes that
+		are already present if `accumulate` is True. Returns True if anything
+		was added.
+		"""
+
+		index = self.index
+		added = False
+		for n in tuples:
+			tup = index.get(n.node)
+			if tup is None:
+				index[n.node] = NodeTuple(n.node,n.weight*coefficient)
+				added = True
+			elif accumulate:
+				tup.weight += n.weight*coefficient
+				added = True
+		if added:
+			self.sorted = False
+		return added
+
 	def append(self,node):
 
 		"""
@@ -62,39 +147,38 @@ class NodeList(object):
 		combination of) strings, Nodes, manually notated tuples, NodeTuples, or
 		NodeLists.
 		"""
-		out = self.parent.settings.ACCUMULATE_RELATIONSHIPS or not self.contains(node)
-		if out:
-			self.nodes += tuplate(node,self.parent)
-			self.sorted = False
-		return out
+
+		if type(node) == NodeList:
+			node = node.index.values()
+		else:
+			node = tuplate(node,registry=self.parent)
+		return self._insert(node,self.parent.settings.ACCUMULATE_RELATIONSHIPS)
 	merge = append
 
 	def contains(self,node):
-		node = tuplate(node)[0].node
-		for n in self.nodes:
-			if n.node == node:
-				return True
-		return False
+		if type(node) == Node:
+			return node in self.index
+		node = tuplate(node,registry=self.parent)
+		return len(node) > 0 and node[0].node in self.index
 
 	def sort(self):
 
 		"""
 		Sorts all contained NodeTuples by weight, highest first. Nodes
-		represented by multiple NodeTuples within the list are consolidated.
+		represented by multiple NodeTuples are consolidated as they are
+		added, so this only re-sorts when the list has changed.
 		"""
 
 		if not self.sorted:
-			reg = {}
-			for n in self.nodes:
-				if not n.node in reg:
-					reg[n.node] = NodeTuple(n.node,0)
-				reg[n.node].addWeight(n.weight)
-			self.nodes = sorted([reg[k] for k in reg],key=lambda tup: tup.weight,reverse=True)
+			start = time.perf_counter() if PROFILER.enabled else 0
+			self.ranked = sorted(self.index.values(),key=lambda tup: tup.weight,reverse=True)
 			self.sorted = True
+			if start:
+				PROFILER.record('nodelist.sort',start,len(self.ranked))
 		return self
 
 	def isEmpty(self):
-		return len(self.nodes) == 0
+		return len(self.index) == 0
 
 	def isLoaded(self):
 
@@ -107,8 +191,8 @@ class NodeList(object):
 
 		if self.isEmpty():
 			return False
-		for n in self.nodes:
-			if not n.node.loaded:
+		for n in self.index:
+			if not n.loaded:
 				return False
 		return True
 
@@ -119,8 +203,8 @@ class NodeList(object):
 		value `l`
 		"""
 
-		for n in self:
-			n.node.loaded = l
+		for n in self.index:
+			n.loaded = l
 
 	def load(self):
 
@@ -131,48 +215,200 @@ class NodeList(object):
 		"""
 
 		if not self.isLoaded() and self.parent.dbc.isConnected():
-			self.parent.dbc.load([n.node.name for n in self.nodes])
+			self.parent.dbc.load([n.name for n in self.index])
 		return self
 
-	def rel(self,name=None):
+	def query(self):
+
+		"""
+		Start a DBQuery seeded with the nodes (and weights) of this list, to
+		run a chain of rel(), limit(), exclude() and top() calls within the
+		connected database
+		"""
+
+		from dbquery import DBQuery
+		return DBQuery(self.parent,[(n.node.name,n.weight) for n in self])
+
+	def lazy(self):
+
+		"""
+		Start a LazyNodeList seeded with this list, to build a chain of rel(),
+		limit(), exclude() and top() calls that is optimized and run only
+		when its result is needed
+		"""
+
+		from plan import LazyNodeList
+		return LazyNodeList(self)
+
+	def recommend(self,relations=None,alpha=0.15,iterations=20,top=10,method='power',walks=2000,maxDegree=None,scale=1000000):
+
+		"""
+		Recommend the nodes best connected to the nodes within this list by
+		personalized PageRank (random walk with restart) seeded from them.
+
+		`relations` may be a string or list of strings; walks follow all
+			public relations if none are given
+		`alpha` is the probability of a walk restarting at each step
+		`iterations` is the maximum number of power iterations; iteration
+			stops early once the `top` ranking is stable
+		`method` may be 'power' (power iteration) or 'walk' (`walks` Monte
+			Carlo walks)
+		`maxDegree` caps the relatives followed from any node to its
+			`maxDegree` heaviest, bounding the cost of high-degree hubs;
+			RANK_MAX_DEGREE by default, 0 for no cap
+
+		returns a NodeList of the `top` recommended nodes (not including the
+		nodes within this list), weighted by their score times `scale`
+		"""
+
+		from ranking import PageRank
+		seeds = dict([(n.node,n.weight) for n in self.index.values() if n.weight > 0])
+		if not seeds:
+			return NodeList([],self.parent)
+		ranker = PageRank(self.parent,relations,alpha,maxDegree)
+		if method == 'walk':
+			scores = ranker.walk(seeds,walks)
+		else:
+			scores = ranker.power(seeds,iterations,top)
+		best = heapq.nlargest(top + len(seeds),scores.items(),key=lambda i: i[1])
+		best = [(n,int(round(s * scale))) for n,s in best if n not in seeds][:top]
+		return NodeList.fromTuples([NodeTuple(n,w) for n,w in best if w > 0],self.parent)
+
+	def rel(self,name=None,load=1):
 
 		"""
 		Get NodeList of all nodes related to the nodes within this list by
 		the given `name`. `name` may be a string or list of strings. Returns
-		all related nodes if no name is given.
-		"""
+		all related nodes if no name is given. The related nodes are loaded
+		from the connected database, if any, unless `load` is False; in
+		out-of-core mode (see MAX_LOADED_NODES), they are loaded when they
+		are expanded in turn instead. If `load` is False, nothing is loaded
+		or evicted at all: the nodes of this list are expanded as they are
+		in memory, without touching the database.
+		"""
+
+		start = time.perf_counter() if PROFILER.enabled else 0
+		cache = self.parent.relCache()
+		if cache:
+			key = cache.key(self,name)
+			out = cache.get(key,self.parent.versions)
+			if out is not None:
+				return self._expanded(out.load() if load else out,name,start)
 
-		self.sort()
 		out = NodeList([],self.parent)
-		if not name:
-			for tup in [(self.parent.registry[n.node],n.weight) for n in self.nodes]:
-				for rel in tup[0]:
-					out.append(tup[0][rel]*tup[1])
-		else:
+		stamps = {}
+		limit = self.parent.settings.MAX_LOADED_NODES
 
-			# Get relation node referenced by input `name`
+		# Get relation nodes referenced by input `name`, None meaning all
+		relation = None
+		if name:
 			relation = [n.node for n in self.parent.get(name,load=0)]
 			if not relation:
-				return out
+				return self._expanded(out,name,start)
+
+		# In out-of-core mode, nodes may have been evicted since they were
+		#	loaded. They are loaded again and pinned in chunks that fit
+		#	within MAX_LOADED_NODES, so that loading one part of this list
+		#	never evicts another part while it is expanded.
+		if limit and load:
+			seeds = self.nodes
+			step = max(limit // 2,1)
+			for i in range(0,len(seeds),step):
+				chunk = seeds[i:i+step]
+				nodes = [n.node for n in chunk]
+				self.parent.pin(nodes)
+				try:
+					NodeList.fromNodes(nodes,self.parent).load()
+					self.parent.use(nodes)
+					self._expand(out,chunk,relation,stamps)
+				finally:
+					self.parent.unpin(nodes)
+		else:
+			self._expand(out,self.nodes,relation,stamps)
 
-			# Iterate over list of tuples containing the relatives of this
-			#	list's nodes and the weight
-			for tup in [(self.parent.registry[n.node],n.weight) for n in self.nodes]:
-				for r in relation:
-					if r in tup[0]:
-					 	out.append(tup[0][r]*tup[1])
-		
-		return out.sort().load()
+		# Evicted seeds were expanded as they are without `load`
+		if cache and (load or not limit):
+			cache.put(key,out,stamps)
+		return self._expanded(out.load() if load and not limit else out,name,start)
+
+	def _expand(self,out,seeds,relation,stamps):
+
+		"""
+		Private helper for rel(), accumulates the relatives of the given
+		NodeTuples by the given relation Nodes (all if None) into `out`,
+		scaled by the weight of the node they are related to. The versions
+		of the seeds are copied into `stamps` before they are read, so that
+		a cached result is never stamped newer than what it was built from.
+		"""
+
+		acc = self.parent.settings.ACCUMULATE_RELATIONSHIPS
+		versions = self.parent.versions
+		with self.parent.lock.read():
+			for n in seeds:
+				stamps[n.node] = versions.get(n.node,0)
+				rels = self.parent.registry[n.node]
+				for r in (rels if relation is None else relation):
+					if r in rels:
+						out._insert(rels[r].nodes,acc,n.weight)
+
+	def _expanded(self,out,name,start):
+
+		"""
+		Private helper for rel(), records the expansion into `out` that
+		started at `start` with the profiler, if it was enabled then
+		"""
+
+		if start:
+			PROFILER.record('nodelist.rel',start,len(out.index))
+			if PROFILER.traces:
+				PROFILER.hop(name,len(self.index),len(out.index),start)
+		return out
+
+	def relatedBy(self,name=None):
+
+		"""
+		Get NodeList of all nodes that are related to the nodes within this
+		list by the given `name`: the reverse of rel(). For instance,
+		g.get('bob').relatedBy('friends') are all the nodes that have Bob as
+		a friend. `name` may be a string or list of strings; all relations
+		are used if no name is given. Requires the INDEX_INCOMING setting
+		(raises an Exception otherwise), and only the relationships that are
+		in memory are known.
+		"""
+
+		out = NodeList([],self.parent)
+		acc = self.parent.settings.ACCUMULATE_RELATIONSHIPS
+		for n in self.nodes:
+			out._insert([NodeTuple(src,w) for src,w in self.parent.relatedBy(n.node,name)],acc,n.weight)
+		return out.load()
+
+	def _top(self,n):
+
+		"""
+		Private helper for eq() and top(), returns the first `n` NodeTuples
+		of the sorted list. Unless the list is already sorted, they are
+		selected with a heap instead of sorting the whole list; ties keep
+		the order in which nodes were added, just like sort(). A negative
+		`n` counts from the end, as in a slice, from the sorted list.
+		"""
+
+		if self.sorted or n < 0 or n >= len(self.index) // 4:
+			return self.nodes[:n]
+		return heapq.nlargest(n,self.index.values(),key=lambda tup: tup.weight)
 
 	def eq(self,index):
 
 		"""
 		Get the node at the given `index` within this sorted list, returning
-		None if `index` trespasses the number of nodes in the list
+		None if `index` trespasses the number of nodes in the list. A
+		negative `index` counts from the end of the list.
 		"""
 
-		self.sort()
-		return None if index >= len(self.nodes) else self.nodes[index].node
+		if index >= len(self.index):
+			return None
+		if index < 0:
+			return self.nodes[index].node
+		return self._top(index+1)[index].node
 
 	def first(self):
 
@@ -181,15 +417,35 @@ class NodeList(object):
 		alias for eq(0)
 		"""
 
-		return self.eq(0)
+		if self.sorted or self.isEmpty():
+			return self.eq(0)
+		return max(self.index.values(),key=lambda tup: tup.weight).node
 
 	def top(self,n):
 
 		"""
-		Return a NodeList contaning the first `n` nodes from this list
+		Return a NodeList contaning the first `n` nodes from this sorted list
 		"""
 
-		return NodeList(self.nodes[:n],self.parent)
+		return NodeList.fromTuples(self._top(n),self.parent)
+
+	def iterRanked(self):
+
+		"""
+		Yields the NodeTuples of this list in sorted order. Unless the list is
+		already sorted, they are popped from a heap one at a time, so taking
+		only the first few costs much less than sorting the whole list.
+		"""
+
+		if self.sorted:
+			for n in self.ranked:
+				yield n
+			return
+		heap = [(-n.weight,i,n) for i,n in enumerate(self.index.values())]
+		heapq.heapify(heap)
+		while heap:
+			yield heapq.heappop(heap)[2]
+	iter_ranked = iterRanked
 
 	def bottom(self,n):
 
@@ -197,7 +453,7 @@ class NodeList(object):
 		Return a NodeList containing the last `n` nodes from this list
 		"""
 
-		return NodeList(self.nodes[-n:],self.parent)
+		return NodeList.fromTuples(self.nodes[-n:],self.parent)
 
 	def sublist(self,start,end):
 
@@ -206,32 +462,93 @@ class NodeList(object):
 		`start` and ending at index `end`
 		"""
 
-		return NodeList(self.nodes[start:end],self.parent)
+		return NodeList.fromTuples(self.nodes[start:end],self.parent)
+
+	def _set(self,nodes):
+
+		"""
+		Private helper for limit() and exclude(), returns the set of Nodes in
+		the given `nodes`, in any of the forms they accept
+		"""
+
+		if type(nodes) == NodeList:
+			return nodes.index
+		return set([tup.node for tup in tuplate(nodes,registry=self.parent)])
+
+	def _list(self,nodes):
+
+		"""
+		Private helper for intersect() and union(), returns the given `nodes`
+		as a NodeList
+		"""
+
+		if type(nodes) == NodeList:
+			return nodes
+		return NodeList.fromTuples(tuplate(nodes,registry=self.parent),self.parent)
 
 	def limit(self,nodes):
 
 		"""
 		Removes all nodes that are not within the given `nodes`; take the
-		intersection between this list and the list provided. `nodes` may be a
-		list of (any combination of) strings, nodes, manually notated tuples,
-		NodeTuples, or NodeLists.
+		intersection between this list and the list provided, keeping the
+		weights of this list. `nodes` may be a list of (any combination of)
+		strings, nodes, manually notated tuples, NodeTuples, or NodeLists.
 		"""
 
-		self.sort()
-		nodes = list(map(lambda tup: tup.node,tuplate(nodes,registry=self.parent)))
-		return NodeList([n for n in self.nodes if n.node in nodes],self.parent)
+		keep = self._set(nodes)
+		return NodeList.fromTuples([n for n in self.index.values() if n.node in keep],self.parent)
 
 	def exclude(self,nodes):
 
 		"""
 		Removes all of the given `nodes` from the list. `nodes` may be a list
 		of (any combination of) strings, nodes, manually notated tuples,
-		NodeTuples, or NodeLists.
+		NodeTuples, or NodeLists. Also the `-` operator.
 		"""
 
-		self.sort()
-		nodes = list(map(lambda tup: tup.node,tuplate(nodes,registry=self.parent)))
-		return NodeList([n for n in self.nodes if n.node not in nodes],self.parent)
+		drop = self._set(nodes)
+		return NodeList.fromTuples([n for n in self.index.values() if n.node not in drop],self.parent)
+
+	def intersect(self,nodes,combine=None):
+
+		"""
+		Returns the nodes that are both within this list and the given
+		`nodes` (in any of the forms limit() accepts), weighted by
+		`combine(weight here, weight there)`; by default, the sum of both
+		weights. Also the `&` operator.
+		"""
+
+		other = self._list(nodes)
+		if len(other.index) < len(self.index):
+			both = [n for n in other.index.values() if n.node in self.index]
+		else:
+			both = [n for n in self.index.values() if n.node in other.index]
+		combine = combine or (lambda a,b: a + b)
+		return NodeList.fromTuples([NodeTuple(n.node,combine(self.index[n.node].weight,other.index[n.node].weight)) for n in both],self.parent)
+
+	def union(self,nodes,combine=None):
+
+		"""
+		Returns the nodes that are within this list or the given `nodes` (in
+		any of the forms limit() accepts). Nodes within both are weighted by
+		`combine(weight here, weight there)`; by default, the sum of both
+		weights. Also the `|` operator.
+		"""
+
+		other = self._list(nodes)
+		out = NodeList.fromTuples(self.index.values(),self.parent)
+		if combine is None:
+			out._insert(other.index.values(),True)
+			return out
+		index = out.index
+		for n in other.index.values():
+			tup = index.get(n.node)
+			if tup is None:
+				index[n.node] = NodeTuple(n.node,n.weight)
+			else:
+				tup.weight = combine(tup.weight,n.weight)
+		out.sorted = False
+		return out
 
 	def info(self):
 
@@ -269,15 +586,17 @@ class NodeList(object):
 		return [(n.node.name,n.weight) for n in self]
 
 	def format(self,margin=4,maxwidth=80):
-		return re.sub('\s*(.{%d}\s*[^,\]]+)[,\]]' % maxwidth,'\n'+(' '*margin)+'...   \\1',self.nodes.__str__())
+		return re.sub(r'\s*(.{%d}\s*[^,\]]+)[,\]]' % maxwidth,'\n'+(' '*margin)+'...   \\1',self.nodes.__str__())
 
 class NodeTuple(object):
 	"""
 	Class representing a `node` and an integer `weight`.
 	"""
+	__slots__ = ('node','weight')
+
 	def __init__(self, node, weight):
-		super(NodeTuple, self).__init__()
-		enforceType(weight,int,'Tuple weight must be an integer ({0} was provided)')
+		if type(weight) != int:
+			enforceType(weight,int,'Tuple weight must be an integer ({0} was provided)')
 		self.node = node
 		self.weight = weight
 
@@ -305,9 +624,14 @@ def tuplate(src,create=0,load=0,registry=None):
 			NodeTuples, or a single one of those
 
 		Returns a list of NodeTuples (*not* a NodeList)
+
+		NodeTuples of Nodes are passed through and Nodes are wrapped directly,
+		in a single pass; only names are dereferenced through the `registry`.
+		Internal code holding NodeTuples or Nodes already should use
+		NodeList.fromTuples() or NodeList.fromNodes() instead.
 		"""
 
-		src = enlist(src)
+		start = time.perf_counter() if PROFILER.enabled else 0
 
 		def dereference(n):
 			if registry:
@@ -316,29 +640,33 @@ def tuplate(src,create=0,load=0,registry=None):
 			else:
 				return None
 
-		def p(n):
-			if type(n) == str:
+		out = []
+		for n in (src if type(src) == list else (src,)):
+			t = type(n)
+			if t == NodeTuple:
+				if type(n.node) == str:
+					n.node = dereference(n.node)
+				if n.node:
+					out.append(n)
+			elif t == Node:
+				out.append(NodeTuple(n,1))
+			elif t == str:
 				o = dereference(n)
-				return None if not o else NodeTuple(o,1)
-			elif type(n) == Node:
-				return NodeTuple(n,1)
-			elif type(n) == tuple:
+				if o:
+					out.append(NodeTuple(o,1))
+			elif t == tuple:
 				o = n[0]
 				if type(o) == str:
 					o = dereference(o)
-				return None if not o else NodeTuple(o,n[1])
-			elif type(n) == NodeTuple:
-				if type(n.node) == str:
-					n.node = dereference(n.node)
-				return None if not n.node else n
-			elif type(n) == NodeList:
-				return n
-			else:
-				return None
-
-		return flatten(list(filter(lambda i: i!=None,list(map(p,src)))))
+				if o:
+					out.append(NodeTuple(o,n[1]))
+			elif t == NodeList:
+				out.extend(n.nodes)
+		if start:
+			PROFILER.record('tuplate',start,len(out))
+		return out
 
-def flatten(arr):
+def flatten(arr,out=None):
 
 	"""
 	Flatten a list, works with all sequences (ie, variables with __iter__
@@ -347,10 +675,11 @@ def flatten(arr):
 	Example: [1,2,[3,4],5,[6,7,[8]]] => [1,2,3,4,5,6,7,8]
 	"""
 
-	out = []
+	if out is None:
+		out = []
 	for a in arr:
 		if hasattr(a,'__iter__'):
-			out += flatten(a)
+			flatten(a,out)
 		else:
 			out.append(a)
-	return out
\ No newline at end of file
+	return out
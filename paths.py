@@ -0,0 +1,259 @@
+import heapq
+import itertools
+from nodes import *
+from common import *
+
+class Path(object):
+
+	"""
+	Class representing a route through the graph: the `nodes` visited in
+	order, the `relations` followed between them, and its total `cost`
+	"""
+
+	def __init__(self, nodes, relations, cost):
+		super(Path, self).__init__()
+		self.nodes = nodes
+		self.relations = relations
+		self.cost = cost
+
+	def __str__(self):
+		return '{0} ({1})'.format(' -> '.join([n.name for n in self.nodes]),self.cost)
+	__repr__ = __str__
+
+	def __iter__(self):
+		for n in self.nodes:
+			yield n
+
+	def __len__(self):
+		return len(self.nodes)
+
+	def names(self):
+		return [n.name for n in self.nodes]
+
+
+class PathFinder(object):
+
+	"""
+	Weighted shortest path search over the relationships of a NodeRegistry,
+	with Dijkstra's algorithm, A* (given a heuristic), or a bidirectional
+	Dijkstra search. Nodes are loaded from the connected database, if any,
+	only as the search reaches them.
+	"""
+
+	def __init__(self, registry):
+		super(PathFinder, self).__init__()
+		self.registry = registry
+
+	def _node(self,node):
+		if type(node) == Node:
+			return node
+		return self.registry.get(node).first()
+
+	def _relations(self,names):
+
+		"""
+		Private helper, returns the relation Nodes referenced by `names`, or
+		None (meaning all public relations) if no names are given
+		"""
+
+		if not names:
+			return None
+		return [n.node for n in self.registry.get(names,load=0)]
+
+	def _neighbours(self,node,relations):
+
+		"""
+		Private helper, returns a (relation, relative, weight) tuple for each
+		edge of `node` by one of the given `relations`, loading `node` first
+		if needed
+		"""
+
+		reg = self.registry
+		if not node.loaded and reg.dbc.isConnected():
+			reg.dbc.load([node.name])
+		out = []
+		with reg.lock.read():
+			rels = reg.registry[node]
+			for r in (relations if relations is not None else rels):
+				if r in rels and (relations is not None or r.name[0] != '_'):
+					for t in rels[r].index.values():
+						out.append((r,t.node,t.weight))
+		return out
+
+	def _incoming(self,node,relations,reverse):
+
+		"""
+		Private helper for bidirectional searches, returns a (relation,
+		relative, weight) tuple for each edge by one of the given `relations`
+		from a relative to `node`. Without `reverse` relations, the
+		registry's incoming edge index is used if no database is connected;
+		with one, the index misses the edges that are not loaded, so
+		`relations` are assumed to be their own reverse. Given `reverse`
+		relations (or in that case), candidate relatives are found through
+		them from `node`, and the weight is that of the forward edge.
+		"""
+
+		reg = self.registry
+		out = []
+		if reverse is None and not reg.dbc.isConnected():
+			with reg.lock.read():
+				for relation,sources in reg.incoming.get(node,{}).items():
+					if relations is None and relation.name[0] != '_' or relations is not None and relation in relations:
+						for relative in sources:
+							out.append((relation,relative,reg._weight(relative,relation,node)))
+			return out
+
+		seen = set()
+		for rrel,relative,rweight in self._neighbours(node,reverse if reverse is not None else relations):
+			if relative in seen:
+				continue
+			seen.add(relative)
+			for relation,target,weight in self._neighbours(relative,relations):
+				if target is node:
+					out.append((relation,relative,weight))
+		return out
+
+	def find(self,src,dst,relations=None,cost=None,heuristic=None,bidirectional=False,maxDepth=None,reverse=None):
+
+		"""
+		Finds the cheapest path from node `src` to node `dst`.
+
+		`src` and `dst` may be names or Nodes
+		`relations` may be a relation name or list of names to follow; all
+			public relations are followed by default
+		`cost` may be a function (node, relation, relative, weight) returning
+			the non-negative cost of an edge; defaults to the edge weight
+		`heuristic` may be a function (node, dst) returning a lower bound of
+			the cost from `node` to `dst`, which turns the search into A*
+		`bidirectional` searches from both ends at once. The backward search
+			finds the edges leading to a node through its `reverse` relations
+			if given. Otherwise, it uses the incoming edge index, which
+			requires the INDEX_INCOMING setting; if a database is connected,
+			it follows `relations` backwards instead, which is only right for
+			relations that are their own reverse, like those created with
+			Graph.biject().
+		`maxDepth` limits the number of edges in the path
+
+		returns a Path, or None if there is no path
+		"""
+
+		src = self._node(src)
+		dst = self._node(dst)
+		if not src or not dst:
+			return None
+		cost = cost or (lambda node,relation,relative,weight: weight)
+		relations = self._relations(relations)
+		if bidirectional:
+			if maxDepth is not None:
+				raise Exception('PathFinder: maxDepth is not supported by bidirectional search')
+			if not reverse and not self.registry.settings.INDEX_INCOMING:
+				raise Exception('PathFinder: bidirectional search requires the INDEX_INCOMING setting or `reverse` relations')
+			return self._bidirectional(src,dst,relations,self._relations(reverse) if reverse else None,cost)
+		return self._search(src,dst,relations,cost,heuristic,maxDepth)
+
+	def _search(self,src,dst,relations,cost,heuristic,maxDepth):
+
+		"""
+		Private helper for find(), runs Dijkstra's algorithm, or A* if a
+		`heuristic` is given. With a `maxDepth`, nodes are settled once for
+		each depth at which they are reached.
+		"""
+
+		h = heuristic or (lambda node,dst: 0)
+		key = (lambda node,depth: node) if maxDepth is None else (lambda node,depth: (node,depth))
+		counter = itertools.count()
+		start = key(src,0)
+		best = {start: 0}
+		prev = {start: None}
+		heap = [(h(src,dst),next(counter),0,src,0)]
+		settled = set()
+
+		while heap:
+			f,c,g,node,depth = heapq.heappop(heap)
+			k = key(node,depth)
+			if k in settled:
+				continue
+			settled.add(k)
+			if node is dst:
+				return self._path(prev,k,g,maxDepth is not None)
+			if maxDepth is not None and depth >= maxDepth:
+				continue
+			for relation,relative,weight in self._neighbours(node,relations):
+				step = cost(node,relation,relative,weight)
+				if step < 0:
+					raise Exception('PathFinder: Negative edge cost ({0} -> {1})'.format(node,relative))
+				rk = key(relative,depth+1)
+				if rk in settled or best.get(rk,g + step + 1) <= g + step:
+					continue
+				best[rk] = g + step
+				prev[rk] = (k,relation)
+				heapq.heappush(heap,(g + step + h(relative,dst),next(counter),g + step,relative,depth+1))
+		return None
+
+	def _path(self,prev,k,cost,keyed):
+
+		"""
+		Private helper, builds the Path ending at key `k` from the `prev`
+		links of a search
+		"""
+
+		nodes = []
+		relations = []
+		while k is not None:
+			nodes.append(k[0] if keyed else k)
+			link = prev[k]
+			if link:
+				relations.append(link[1])
+			k = link[0] if link else None
+		nodes.reverse()
+		relations.reverse()
+		return Path(nodes,relations,cost)
+
+	def _bidirectional(self,src,dst,relations,reverse,cost):
+
+		"""
+		Private helper for find(), runs Dijkstra's algorithm from `src` along
+		`relations` and from `dst` along `reverse` until the two searches
+		can no longer improve on the best meeting point
+		"""
+
+		counter = itertools.count()
+		dist = [{src: 0},{dst: 0}]
+		prev = [{src: None},{dst: None}]
+		heaps = [[(0,next(counter),src)],[(0,next(counter),dst)]]
+		settled = [set(),set()]
+		best = None
+		meet = None
+
+		while heaps[0] and heaps[1]:
+			if best is not None and heaps[0][0][0] + heaps[1][0][0] >= best:
+				break
+			side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+			g,c,node = heapq.heappop(heaps[side])
+			if node in settled[side]:
+				continue
+			settled[side].add(node)
+			edges = self._neighbours(node,relations) if side == 0 else self._incoming(node,relations,reverse)
+			for relation,relative,weight in edges:
+				step = cost(node,relation,relative,weight) if side == 0 else cost(relative,relation,node,weight)
+				if step < 0:
+					raise Exception('PathFinder: Negative edge cost ({0} -> {1})'.format(node,relative))
+				if relative in settled[side] or dist[side].get(relative,g + step + 1) <= g + step:
+					continue
+				dist[side][relative] = g + step
+				prev[side][relative] = (node,relation)
+				heapq.heappush(heaps[side],(g + step,next(counter),relative))
+				if relative in dist[1-side] and (best is None or g + step + dist[1-side][relative] < best):
+					best = g + step + dist[1-side][relative]
+					meet = relative
+			if node in dist[1-side] and (best is None or g + dist[1-side][node] < best):
+				best = g + dist[1-side][node]
+				meet = node
+
+		if meet is None:
+			return None
+		forward = self._path(prev[0],meet,0,False)
+		backward = self._path(prev[1],meet,0,False)
+		backward.nodes.reverse()
+		backward.relations.reverse()
+		return Path(forward.nodes + backward.nodes[1:],forward.relations + backward.relations,best)
@@ -0,0 +1,193 @@
+import heapq
+import time
+from nodes import *
+from common import *
+
+class LazyNodeList(object):
+
+	"""
+	A chain of rel(), limit(), exclude() and top() calls on a NodeList that
+	is only run when its result is needed: when it is iterated, or when
+	run(), first(), eq(), names() or tuples() is called.
+
+	Before running, the chain is turned into a plan by optimize():
+
+	- intermediate frontiers are kept as unsorted node -> weight dicts, so
+	  only the final result is sorted
+	- limit() and exclude() calls are merged and pushed into the frontier
+	  they filter: into the expansion of the preceding rel(), so filtered
+	  nodes are never accumulated, or into the seed before it is expanded
+	- top(n) selects the `n` heaviest nodes with a heap instead of sorting
+
+	LazyNodeLists are immutable; every method returns a new one.
+	"""
+
+	def __init__(self,seed,steps=None):
+		super(LazyNodeList, self).__init__()
+		self.seed = seed
+		self.parent = seed.parent
+		self.steps = steps or []
+
+	def __str__(self):
+		lines = ['Seed ({0} nodes)'.format(len(self.seed))]
+		for op in self.optimize():
+			if op[0] == 'top':
+				desc = 'TopK {0}'.format(op[1])
+			else:
+				desc = 'Expand {0}'.format(', '.join(op[1]) or '*') if op[0] == 'expand' else 'Filter'
+				if op[2]:
+					desc += ' [limit to {0} lists]'.format(len(op[2]))
+				if op[3]:
+					desc += ' [exclude {0} lists]'.format(len(op[3]))
+			lines.append(desc)
+		return '\n'.join([('  ' * i) + l for i,l in enumerate(reversed(lines))])
+	__repr__ = __str__
+
+	def __iter__(self):
+		for n in self.run():
+			yield n
+
+	def _then(self,op,arg):
+		return LazyNodeList(self.seed,self.steps + [(op,arg)])
+
+	def rel(self,name=None):
+		return self._then('rel',enlist(name) if name else [])
+
+	def limit(self,nodes):
+		return self._then('limit',nodes)
+
+	def exclude(self,nodes):
+		return self._then('exclude',nodes)
+
+	def top(self,n):
+		return self._then('top',n)
+
+	def explain(self):
+
+		"""
+		Print the optimized plan of this query, innermost step last
+		"""
+
+		print(self)
+
+	def optimize(self):
+
+		"""
+		Returns the plan for this query, a list of operations run in order
+		on the seed frontier:
+
+		('filter', None, limits, excludes) keeps only the nodes in all `limits`
+			and none of the `excludes`
+		('expand', names, limits, excludes) replaces the frontier with the
+			nodes related to it by `names` (all relations if empty), dropping
+			the nodes filtered by `limits` and `excludes` as it accumulates
+		('top', n) keeps only the `n` heaviest nodes
+		"""
+
+		plan = [('filter',None,[],[])]
+		for op,arg in self.steps:
+			last = plan[-1]
+			if op == 'rel':
+				plan.append(('expand',arg,[],[]))
+			elif op in ('limit','exclude'):
+				if last[0] == 'top':
+					last = ('filter',None,[],[])
+					plan.append(last)
+				last[2 if op == 'limit' else 3].append(arg)
+			elif op == 'top':
+				if last[0] == 'top':
+					plan[-1] = ('top',min(last[1],arg))
+				else:
+					plan.append(('top',arg))
+		return [p for p in plan if p[0] != 'filter' or p[2] or p[3]]
+
+	def _nodes(self,nodes):
+
+		"""
+		Private helper for run(), returns the set of Nodes in `nodes`
+		"""
+
+		if type(nodes) == LazyNodeList:
+			nodes = nodes.run()
+		if type(nodes) == NodeList:
+			return set(nodes.index)
+		return set([n.node for n in tuplate(nodes,registry=self.parent)])
+
+	def run(self):
+
+		"""
+		Run the query, returns a NodeList
+		"""
+
+		reg = self.parent
+		acc = reg.settings.ACCUMULATE_RELATIONSHIPS
+		frontier = dict([(n.node,n.weight) for n in self.seed.index.values()])
+
+		for op in self.optimize():
+
+			if op[0] == 'top':
+				frontier = dict(heapq.nlargest(op[1],frontier.items(),key=lambda i: i[1]))
+				continue
+
+			limits = [self._nodes(n) for n in op[2]]
+			excludes = set().union(*[self._nodes(n) for n in op[3]])
+			def keep(node):
+				if node in excludes:
+					return False
+				for l in limits:
+					if node not in l:
+						return False
+				return True
+
+			if op[0] == 'filter':
+				frontier = dict([(n,w) for n,w in frontier.items() if keep(n)])
+				continue
+
+			start = time.perf_counter() if PROFILER.enabled else 0
+
+			# Load the (filtered) frontier before expanding it
+			if reg.dbc.isConnected() and [n for n in frontier if not n.loaded]:
+				reg.dbc.load([n.name for n in frontier])
+
+			relation = [n.node for n in reg.get(op[1],load=0)] if op[1] else None
+			if relation is not None and not relation:
+				frontier = {}
+				continue
+
+			# Nodes are expanded in the order NodeList.rel() does: by
+			#	descending weight, ties in the order they were added. This
+			#	decides which weight wins without accumulation, and the order
+			#	of the nodes that tie in the result either way.
+			seeds = sorted(frontier.items(),key=lambda i: i[1],reverse=True)
+			out = {}
+			with reg.lock.read():
+				for node,weight in seeds:
+					rels = reg.registry[node]
+					for r in (rels if relation is None else relation):
+						if r in rels:
+							for t in rels[r].nodes:
+								w = out.get(t.node)
+								if w is None:
+									if keep(t.node):
+										out[t.node] = t.weight * weight
+								elif acc:
+									out[t.node] = w + t.weight * weight
+			if start:
+				PROFILER.record('lazy.expand',start,len(out))
+				if PROFILER.traces:
+					PROFILER.hop(op[1],len(frontier),len(out),start)
+			frontier = out
+
+		return NodeList.fromTuples([NodeTuple(n,w) for n,w in frontier.items()],reg).load()
+
+	def first(self):
+		return self.run().first()
+
+	def eq(self,index):
+		return self.run().eq(index)
+
+	def names(self):
+		return self.run().names()
+
+	def tuples(self):
+		return self.run().tuples()
@@ -0,0 +1,125 @@
+import time
+from common import *
+
+class Trace(object):
+
+	"""
+	Record of a single traced query, made with Graph.trace():
+
+		with g.trace('friends of friends') as t:
+			g.get('bob').rel('friends').rel('friends')
+		print(t)
+
+	`hops` holds a (relation, frontier, size, seconds) tuple for each rel()
+	expansion run while tracing: the relation name(s), the number of nodes
+	expanded, the number of nodes reached and the time it took. `counters`
+	and `timers` hold how much the profiler's counters and timers grew
+	while tracing, and `seconds` the total time.
+	"""
+
+	def __init__(self, profiler, name=None):
+		super(Trace, self).__init__()
+		self.profiler = profiler
+		self.name = name
+		self.hops = []
+		self.counters = {}
+		self.timers = {}
+		self.seconds = 0.0
+
+	def __enter__(self):
+		p = self.profiler
+		self.enabled = p.enabled
+		self.before = p.snapshot()
+		p.enabled = True
+		p.traces.append(self)
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		p = self.profiler
+		self.seconds = time.perf_counter() - self.start
+		p.traces.remove(self)
+		p.enabled = self.enabled
+		after = p.snapshot()
+		for attr in ('counters','timers'):
+			old = self.before[attr]
+			setattr(self,attr,dict([(k,v - old.get(k,0)) for k,v in after[attr].items() if v != old.get(k,0)]))
+		del self.before
+		return False
+
+	def __str__(self):
+		lines = ['Trace{0}: {1:.6f}s'.format(' ' + self.name if self.name else '',self.seconds)]
+		for i,(relation,frontier,size,seconds) in enumerate(self.hops):
+			relation = ', '.join(enlist(relation)) if relation else '*'
+			lines.append('  hop {0} {1}: {2} -> {3} nodes, {4:.6f}s'.format(i+1,relation,frontier,size,seconds))
+		for k in sorted(self.counters):
+			lines.append('  {0}: {1}'.format(k,self.counters[k]))
+		return '\n'.join(lines)
+	__repr__ = __str__
+
+
+class Profiler(object):
+
+	"""
+	Counters and cumulative timers for the hot paths of Pylog: tuplate()
+	conversions, NodeList re-sorts and rel() expansions, and database loads
+	and dumps along with the SQL statements they run.
+
+	Profiling is off by default. Instrumented code only checks the `enabled`
+	flag before doing any bookkeeping, so it costs next to nothing while it
+	is off. The profiler is shared by all Graphs of the process, since
+	tuplate() and NodeLists are not bound to a single one.
+	"""
+
+	def __init__(self):
+		super(Profiler, self).__init__()
+		self.enabled = False
+		self.counters = {}
+		self.timers = {}
+		self.traces = []
+
+	def count(self,name,n=1):
+		self.counters[name] = self.counters.get(name,0) + n
+
+	def record(self,name,start,items=None):
+
+		"""
+		Counts a call of `name` that started at `start` (a time.perf_counter()
+		value) and adds its duration to the timer of `name`. `items` may be
+		the number of items the call handled, added to the `name`.items
+		counter.
+		"""
+
+		self.timers[name] = self.timers.get(name,0.0) + time.perf_counter() - start
+		self.counters[name] = self.counters.get(name,0) + 1
+		if items is not None:
+			self.count(name + '.items',items)
+
+	def hop(self,relation,frontier,size,start):
+
+		"""
+		Records a rel() expansion from `frontier` nodes to `size` nodes that
+		started at `start` in the active traces
+		"""
+
+		seconds = time.perf_counter() - start
+		for t in self.traces:
+			t.hops.append((relation,frontier,size,seconds))
+
+	def snapshot(self,reset=False):
+
+		"""
+		Returns a copy of the counters and timers, and resets them if `reset`
+		is True
+		"""
+
+		out = {'counters': dict(self.counters),'timers': dict(self.timers)}
+		if reset:
+			self.reset()
+		return out
+
+	def reset(self):
+		self.counters = {}
+		self.timers = {}
+
+PROFILER = Profiler()
@@ -0,0 +1,146 @@
+import heapq
+import random
+from bisect import bisect_right
+from nodes import *
+from common import *
+
+class PageRank(object):
+
+	"""
+	Personalized PageRank (random walk with restart) over the relationships
+	of a NodeRegistry.
+
+	A walk starts at one of the seed nodes (picked in proportion to its
+	weight), and at every step either restarts, with probability `alpha`,
+	or follows one of the given relations to a relative, picked in proportion
+	to the weight of the edge. The score of a node is the probability of the
+	walk being there. Walks from nodes without any such edges restart.
+
+	The scores can be computed by power iteration, which stops early once
+	the top `k` ranking stops changing, or estimated with Monte Carlo walks,
+	whose cost does not depend on the degree of the nodes they pass through.
+	The relatives of high-degree nodes are capped to their `maxDegree`
+	heaviest ones (RANK_MAX_DEGREE by default, 0 for no cap) to bound the
+	cost of power iteration.
+	"""
+
+	def __init__(self, registry, relations, alpha=0.15, maxDegree=None):
+		super(PageRank, self).__init__()
+		self.registry = registry
+		self.relations = [n.node for n in registry.get(relations,load=0)] if relations else None
+		self.alpha = alpha
+		self.maxDegree = registry.settings.RANK_MAX_DEGREE if maxDegree is None else maxDegree
+		self.edges = {}
+
+	def _edges(self,node):
+
+		"""
+		Private helper, returns the (relatives, cumulative weights) of the
+		edges of `node` by the ranked relations, loading `node` if needed.
+		With a `maxDegree`, only the heaviest relatives by each relation are
+		considered, so that a hub costs no more than a few of them.
+		"""
+
+		out = self.edges.get(node)
+		if out is None:
+			reg = self.registry
+			if not node.loaded and reg.dbc.isConnected():
+				reg.dbc.load([node.name])
+			weights = {}
+			cap = self.maxDegree
+			with reg.lock.read():
+				rels = reg.registry[node]
+				for r in (self.relations if self.relations is not None else rels):
+					if r in rels and (self.relations is not None or r.name[0] != '_'):
+						for t in (rels[r].nodes[:cap] if cap else rels[r].index.values()):
+							if t.weight > 0:
+								weights[t.node] = weights.get(t.node,0) + t.weight
+			items = list(weights.items())
+			if self.maxDegree and len(items) > self.maxDegree:
+				items = heapq.nlargest(self.maxDegree,items,key=lambda i: i[1])
+			total = 0
+			cumulative = []
+			for n,w in items:
+				total += w
+				cumulative.append(total)
+			out = self.edges[node] = ([n for n,w in items],cumulative)
+		return out
+
+	def power(self,seeds,iterations=20,k=10,patience=2,tolerance=1e-6,epsilon=1e-5):
+
+		"""
+		Computes the scores by power iteration, for at most `iterations`
+		iterations. Stops early once the `k` best scored non-seed nodes have
+		stayed the same for `patience` iterations, or once the scores change
+		by less than `tolerance` in total. Nodes scoring less than `epsilon`
+		keep their score instead of spreading it, which keeps the iteration
+		from reaching the whole graph for a negligible gain in precision.
+
+		`seeds` must be a dict of seed Nodes and their (positive) weights
+
+		returns a dict of Nodes and their scores
+		"""
+
+		total = float(sum(seeds.values()))
+		restart = dict([(n,w / total) for n,w in seeds.items()])
+		scores = dict(restart)
+		ranking = None
+		stable = 0
+		for i in range(iterations):
+			nxt = dict([(n,self.alpha * w) for n,w in restart.items()])
+			dangling = 0.0
+			for node,score in scores.items():
+				if score < epsilon:
+					nxt[node] = nxt.get(node,0.0) + score
+					continue
+				relatives,cumulative = self._edges(node)
+				if not relatives:
+					dangling += score
+					continue
+				share = (1 - self.alpha) * score / cumulative[-1]
+				prev = 0
+				for j in range(len(relatives)):
+					nxt[relatives[j]] = nxt.get(relatives[j],0.0) + share * (cumulative[j] - prev)
+					prev = cumulative[j]
+			if dangling:
+				for n,w in restart.items():
+					nxt[n] += (1 - self.alpha) * dangling * w
+			change = sum([abs(nxt.get(n,0.0) - scores.get(n,0.0)) for n in set(nxt).union(scores)])
+			scores = nxt
+			if change < tolerance:
+				break
+			top = [n for n,s in heapq.nlargest(k + len(seeds),scores.items(),key=lambda i: i[1]) if n not in seeds][:k]
+			stable = stable + 1 if top == ranking else 0
+			ranking = top
+			if stable >= patience:
+				break
+		return scores
+
+	def walk(self,seeds,walks=2000,rng=None):
+
+		"""
+		Estimates the scores with `walks` Monte Carlo random walks, counting
+		every node each walk visits
+
+		`seeds` must be a dict of seed Nodes and their (positive) weights
+
+		returns a dict of Nodes and their scores
+		"""
+
+		rng = rng or random.Random()
+		starts = list(seeds)
+		startWeights = [seeds[n] for n in starts]
+		visits = {}
+		steps = 0
+		for i in range(walks):
+			node = rng.choices(starts,startWeights)[0]
+			while True:
+				visits[node] = visits.get(node,0) + 1
+				steps += 1
+				if rng.random() < self.alpha:
+					break
+				relatives,cumulative = self._edges(node)
+				if not relatives:
+					break
+				node = relatives[bisect_right(cumulative,rng.random() * cumulative[-1])]
+		return dict([(n,v / float(steps)) for n,v in visits.items()])
@@ -1,5 +1,24 @@
 from graph import *
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import csv
+import os
 import re
+import time
+
+class ReaderError(Exception):
+
+	"""
+	Raised when a line of source data cannot be parsed
+	"""
+
+	def __init__(self, message, line=None, filename=None):
+		self.message = message
+		self.line = line
+		self.filename = filename
+		where = ', '.join([w for w in [filename, None if line is None else 'line {0}'.format(line)] if w])
+		super(ReaderError, self).__init__('{0}: {1}'.format(where, message) if where else message)
+
 
 class Reader(object):
 	"""
@@ -8,26 +27,299 @@ class Reader(object):
 	def __init__(self, registry):
 		super(Reader, self).__init__()
 		self.registry = registry
-		self.relExp = re.compile("(`.+`(?:\*\d+)?)\s+(<|\=)(.+)(\=|>)\s+(`.+`(?:\*\d+)?)")
-		self.nodeExp = re.compile("`([^`]+)`(?:\*(\d+))?")
-		
+		self.relExp = re.compile(r"(`.+`(?:\*\d+)?)\s+(<|\=)(.+)(\=|>)\s+(`.+`(?:\*\d+)?)")
+		self.nodeExp = re.compile(r"`([^`]+)`(?:\*(\d+))?")
+		self.lineExp = re.compile(r"rel\s+" + self.relExp.pattern + r"\s*$")
+
+		# Number of parsed statements committed to the registry at once
+		self.batchSize = 10000
+
+	def parse(self,exp):
+
+		"""
+		Parses a single statement in a single pass. Returns None for blank
+		lines, ('node', name) for node statements, and ('rel', left, right,
+		leftward, rightward) for rel statements, where `left` and `right` are
+		lists of (name, weight) tuples.
+
+		Raises ReaderError if the statement is malformed
+		"""
+
+		if exp.startswith('rel'):
+			m = self.lineExp.match(exp)
+			if not m:
+				raise ReaderError('Malformed rel statement: {0}'.format(exp.strip()))
+			tkns = m.groups()
+			rel = tkns[2].split('=')
+			left = [(n[0],(int)(n[1] or 1)) for n in self.nodeExp.findall(tkns[0])]
+			right = [(n[0],(int)(n[1] or 1)) for n in self.nodeExp.findall(tkns[4])]
+			return (
+				'rel',
+				left,
+				right,
+				"" if tkns[1] != "<" else rel[0],
+				"" if tkns[3] != ">" else rel[-1]
+			)
+		elif exp.startswith('node'):
+			name = exp[4:].strip()
+			if not name or exp[4] not in ' \t':
+				raise ReaderError('Malformed node statement: {0}'.format(exp.strip()))
+			return ('node',name)
+		elif exp.strip():
+			raise ReaderError('Unknown statement: {0}'.format(exp.strip()))
+		return None
+
 	def eval(self,exp):
-		exp = exp.split(" ")
-		if exp[0] == 'node':
-			self.registry.add(' '.join(exp[1:]))
-		elif exp[0] == 'rel':
-			tkns = self.relExp.findall(' '.join(exp[1:]))[0]
-			if len(tkns) == 5:
-				rel = tkns[2].split('=')
-				self.registry.relate(
-					[(n[0],(int)(n[1] or 1)) for n in self.nodeExp.findall(tkns[0])],
-					[(n[0],(int)(n[1] or 1)) for n in self.nodeExp.findall(tkns[4])],
-					"" if tkns[1] != "<" else rel[0],
-					"" if tkns[3] != ">" else rel[-1]
-				)
+		stmt = self.parse(exp)
+		if stmt and stmt[0] == 'node':
+			self.registry.add(stmt[1])
+		elif stmt:
+			self.registry.relateBatch([stmt[1:]])
 
 	def read(self,filename):
-		f = open(filename,'r')
-		for l in f:
-			self.eval(l)
-		f.close()
\ No newline at end of file
+
+		"""
+		Reads a source file line by line, committing its statements to the
+		registry in batches of `batchSize`.
+
+		Raises ReaderError with the line number of the first malformed line;
+		all of the lines before it are committed.
+
+		returns a dict with the number of `lines` and `statements` read, the
+		`seconds` taken and the resulting `linesPerSecond`
+		"""
+
+		start = time.time()
+		batch = []
+		statements = 0
+		lineno = 0
+		try:
+			with open(filename,'r') as f:
+				for lineno,l in enumerate(f,1):
+					try:
+						stmt = self.parse(l)
+					except ReaderError as e:
+						raise ReaderError(e.message,lineno,filename)
+					if not stmt:
+						continue
+					statements += 1
+					if stmt[0] == 'node':
+						self.registry.add(stmt[1])
+					else:
+						batch.append(stmt[1:])
+						if len(batch) >= self.batchSize:
+							pending,batch = batch,[]
+							self.registry.relateBatch(pending)
+		finally:
+			# Lines before a malformed one are committed; a batch that
+			#	failed to commit is not retried
+			self.registry.relateBatch(batch)
+
+		seconds = time.time() - start
+		return {
+			'lines': lineno,
+			'statements': statements,
+			'seconds': seconds,
+			'linesPerSecond': lineno / seconds if seconds else 0
+		}
+
+	def importEdges(self,source,database=False):
+
+		"""
+		Streams (left, relation, right, weight) edges into the graph in
+		batches of `batchSize`, each making `right` a `relation` of `left`
+		(so that left.rel(relation) holds right), like
+		Graph.relate(left,right,None,relation). The weight may be left out,
+		and defaults to 1.
+
+		`source` may be an iterable of edges, or the name of a CSV file with
+			one edge per row and an optional `left,relation,right,weight`
+			header
+		If `database` is True, the edges are written straight into the
+			connected database instead (see DBC.insertEdges()); otherwise
+			they are related in memory through NodeRegistry.relateBatch()
+
+		Raises ReaderError with the line number of the first malformed CSV
+		row; all of the edges before it are committed.
+
+		returns a dict with the number of `edges` imported, the `seconds`
+		taken and the resulting `edgesPerSecond`
+		"""
+
+		if database and not self.registry.dbc.isConnected():
+			raise Exception('Reader: No database connected')
+		start = time.time()
+		filename = source if type(source) == str else None
+		f = open(source,'r',newline='') if filename else None
+		count = 0
+		batch = []
+
+		def commit(batch):
+			if database:
+				self.registry.dbc.insertEdges(batch)
+			else:
+				self.registry.relateBatch([([(l,1)],[(t,w)],None,r) for l,r,t,w in batch])
+
+		try:
+			for lineno,edge in enumerate(csv.reader(f) if f else source,1):
+				if filename and lineno == 1 and [e.strip().lower() for e in edge[:3]] == ['left','relation','right']:
+					continue
+				try:
+					if len(edge) not in (3,4) or not all(edge[:3]):
+						raise ValueError()
+					edge = (edge[0],edge[1],edge[2],int(edge[3]) if len(edge) == 4 and edge[3] != '' else 1)
+				except ValueError:
+					commit(batch)
+					raise ReaderError('Malformed edge: {0}'.format(edge),lineno,filename)
+				batch.append(edge)
+				if len(batch) >= self.batchSize:
+					commit(batch)
+					count += len(batch)
+					batch = []
+			commit(batch)
+			count += len(batch)
+		finally:
+			if f:
+				f.close()
+
+		seconds = time.time() - start
+		return {
+			'edges': count,
+			'seconds': seconds,
+			'edgesPerSecond': count / seconds if seconds else 0
+		}
+
+	def readAll(self,sources,workers=None):
+
+		"""
+		Reads many source files, or large ones split at line boundaries, by
+		parsing them in a pool of `workers` processes (all CPUs by default).
+		Parsed statements are committed to the registry in source order, so
+		ACCUMULATE_RELATIONSHIPS applies just as if the sources had been read
+		one after another.
+
+		`sources` may be a file or directory name, or a list of them;
+			directories are read recursively, in name order
+
+		Raises ReaderError with the file name and line number of the first
+		malformed line; all of the lines before it are committed.
+
+		returns a dict like read(), plus the number of `files` read
+		"""
+
+		start = time.time()
+		workers = workers or os.cpu_count() or 1
+		files = []
+		for src in enlist(sources):
+			if os.path.isdir(src):
+				for root,dirs,names in os.walk(src):
+					dirs.sort()
+					files += [os.path.join(root,n) for n in sorted(names)]
+			else:
+				files.append(src)
+
+		# Split files into chunks so that all workers have something to do,
+		#	but small enough that the few parsed ahead fit in memory
+		size = sum([os.path.getsize(f) for f in files])
+		chunkSize = min(max(size // (workers * 4),1 << 20),1 << 26)
+		chunks = []
+		for f in files:
+			fsize = os.path.getsize(f)
+			for offset in range(0,fsize or 1,chunkSize):
+				chunks.append((f,offset,min(offset + chunkSize,fsize)))
+
+		stats = {'files': len(files), 'lines': 0, 'statements': 0}
+		if workers > 1 and len(chunks) > 1:
+			pool = ProcessPoolExecutor(workers)
+			results = _parseAhead(pool,chunks,workers * 2)
+		else:
+			pool = None
+			results = map(_parseChunk,chunks)
+		try:
+			for chunk,res in zip(chunks,results):
+				for name in res['nodes']:
+					self.registry.add(name)
+				self.registry.relateBatch(res['edges'])
+				stats['lines'] += res['lines']
+				stats['statements'] += len(res['nodes']) + len(res['edges'])
+				if res['error']:
+					raise ReaderError(res['error'][0],_lineOffset(chunk[0],chunk[1]) + res['error'][1],chunk[0])
+		finally:
+			if pool:
+				pool.shutdown(cancel_futures=True)
+
+		stats['seconds'] = time.time() - start
+		stats['linesPerSecond'] = stats['lines'] / stats['seconds'] if stats['seconds'] else 0
+		return stats
+
+
+def _parseAhead(pool,chunks,ahead):
+
+	"""
+	Private helper for Reader.readAll(), yields the results of parsing
+	`chunks` in `pool`, in order. At most `ahead` chunks are submitted and
+	not yet consumed at a time; the next one is submitted as each result is
+	consumed, so that parsed chunks do not pile up while they are committed.
+	"""
+
+	pending = deque()
+	for chunk in chunks:
+		if len(pending) >= ahead:
+			yield pending.popleft().result()
+		pending.append(pool.submit(_parseChunk,chunk))
+	while pending:
+		yield pending.popleft().result()
+
+def _parseChunk(chunk):
+
+	"""
+	Process pool worker for Reader.readAll(). Parses the lines of file
+	`chunk[0]` that start between byte offsets `chunk[1]` and `chunk[2]`.
+
+	returns a dict with the `nodes` names and the `edges` batch (as taken by
+	NodeRegistry.relateBatch()) parsed, the number of `lines` read, and an
+	`error` (message, line number within the chunk) tuple if parsing stopped
+	at a malformed line
+	"""
+
+	parser = Reader(None)
+	out = {'nodes': [], 'edges': [], 'lines': 0, 'error': None}
+	with open(chunk[0],'rb') as f:
+		if chunk[1]:
+			f.seek(chunk[1] - 1)
+			f.readline()
+		while f.tell() < chunk[2]:
+			l = f.readline()
+			if not l:
+				break
+			out['lines'] += 1
+			try:
+				stmt = parser.parse(l.decode('utf-8'))
+			except ReaderError as e:
+				out['error'] = (e.message,out['lines'])
+				break
+			if stmt and stmt[0] == 'node':
+				out['nodes'].append(stmt[1])
+			elif stmt:
+				out['edges'].append(stmt[1:])
+	return out
+
+def _lineOffset(filename,offset):
+
+	"""
+	Returns the number of lines of file `filename` that start before byte
+	`offset`
+	"""
+
+	if not offset:
+		return 0
+	count = 1
+	offset -= 1
+	with open(filename,'rb') as f:
+		while offset > 0:
+			block = f.read(min(offset,1 << 20))
+			if not block:
+				break
+			count += block.count(b'\n')
+			offset -= len(block)
+	return count
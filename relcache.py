@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from nodes import *
+from concurrency import NULL_LOCK
+
+class RelCache(object):
+
+	"""
+	Least recently used cache of NodeList.rel() results, keyed on the seed
+	nodes (and their weights) and the relation names.
+
+	Every entry remembers the version of each of its seed nodes at the time
+	it was stored. NodeRegistry bumps the version of a node whenever its
+	relationships change (through relate(), which DBC.load() also uses),
+	which invalidates the entries seeded from it.
+
+	A `mutex` (such as a threading.Lock) may be given to guard the entries
+	when the cache is shared between threads.
+	"""
+
+	def __init__(self, size, mutex=None):
+		super(RelCache, self).__init__()
+		self.size = size
+		self.mutex = mutex or NULL_LOCK
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+	def key(self,nodes,name):
+		names = tuple(sorted([n.lower() for n in enlist(name)])) if name else None
+		return (frozenset([(n.node,n.weight) for n in nodes.index.values()]),names)
+
+	def get(self,key,versions):
+
+		"""
+		Returns a copy of the cached result for `key`, or None if there is no
+		valid entry for it
+		"""
+
+		with self.mutex:
+			entry = self.entries.get(key)
+			if entry is not None:
+				for node,version in entry[0]:
+					if versions.get(node,0) != version:
+						del self.entries[key]
+						self.invalidations += 1
+						entry = None
+						break
+			if entry is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.entries.move_to_end(key)
+		return NodeList.fromTuples(entry[1].index.values(),entry[1].parent)
+
+	def put(self,key,result,versions):
+
+		"""
+		Stores a copy of `result` for `key`, stamped with the `versions` its
+		seed nodes had when it was computed, evicting the least recently used
+		entries beyond `size`
+		"""
+
+		copy = NodeList.fromTuples(result.index.values(),result.parent)
+		with self.mutex:
+			self.entries[key] = (tuple([(n,versions.get(n,0)) for n,w in key[0]]),copy)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+
+	def clear(self):
+		with self.mutex:
+			self.entries.clear()
+
+	def stats(self):
+		return {
+			'size': len(self.entries),
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+			'invalidations': self.invalidations
+		}
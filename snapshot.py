@@ -0,0 +1,426 @@
+import mmap
+import struct
+import sys
+from itertools import chain
+from array import array
+from bisect import bisect_left
+from nodes import *
+from compactRegistry import Relation, CompactRegistry
+from nodeRegistry import NodeRegistry
+from nameindex import NameIndex
+
+# File layout: a header, a table of contents, then 8-byte aligned sections.
+#
+#	header    magic, version, byte order (0 little, 1 big), section count,
+#	          node count
+#	contents  one (tag, relation ID or -1, offset, length) entry per section
+#
+#	NAMEOFS   q[nodes+1]  offsets of every node's name within NAMES
+#	NAMES     utf-8 names of all nodes, by node ID
+#	ORDER     i[nodes]    node IDs sorted by lowercased name (the ID index)
+#
+# and, for every relation, the sections of its Relation arrays (ROWS,
+# OFFSETS, TARGETS, WEIGHTS, RANKS; see compactRegistry.Relation), its incoming
+# edges in the same layout (INROWS, INOFS and SOURCES, the sources of the
+# edges to every target) and its participants (PARTS, their IDs, and PARTW,
+# their counts).
+
+MAGIC = b'PYLOGSNP'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQ')
+ENTRY = struct.Struct('<8sqQQ')
+
+def _csr(edges):
+
+	"""
+	Private helper for save(), builds the (rows, offsets, targets, weights,
+	ranks) arrays from a sorted list of (source, target, weight, rank) edges
+	"""
+
+	rows = array('i')
+	offsets = array('q',[0])
+	targets = array('i')
+	weights = array('q')
+	ranks = array('i')
+	for src,dst,w,rank in edges:
+		if not rows or rows[-1] != src:
+			if rows:
+				offsets.append(len(targets))
+			rows.append(src)
+		targets.append(dst)
+		weights.append(w)
+		ranks.append(rank)
+	if rows:
+		offsets.append(len(targets))
+	return rows,offsets,targets,weights,ranks
+
+def save(registry,path):
+
+	"""
+	Writes a snapshot of all of the nodes and relationships in `registry` to
+	the file at `path`. Node data is not saved.
+
+	returns a dict with the number of `nodes` and `edges` saved
+	"""
+
+	with registry.lock.write():
+		if isinstance(registry,CompactRegistry):
+			registry.compact()
+			nodes = list(registry.nodes)
+			ids = None
+		else:
+			nodes = list(registry.registry)
+			ids = dict([(n,i) for i,n in enumerate(nodes)])
+		ident = (lambda n: n.id) if ids is None else ids.get
+
+		# Collect the edges of every relation, ranked in the order they were
+		#	added, sorted by source and target
+		relations = {}
+		if ids is None:
+			for rid,rel in registry.relations.items():
+				relations[rid] = [(src,dst,w,k) for src in rel.sources() for k,(dst,w) in enumerate(rel.edges(src))]
+		else:
+			for node,rels in registry.registry.items():
+				src = ids[node]
+				for relation,relatives in rels.items():
+					edges = relations.setdefault(ids[relation],[])
+					edges.extend([(src,ids[t.node],t.weight,k) for k,t in enumerate(relatives.index.values())])
+		for edges in relations.values():
+			edges.sort()
+
+		participants = {}
+		for relation,members in registry.participants.items():
+			if ident(relation) is not None:
+				participants[ident(relation)] = sorted([(ident(n),w) for n,w in members.items() if ident(n) is not None])
+
+	names = [n.name.encode('utf-8') for n in nodes]
+	nameOffsets = array('q',[0])
+	for name in names:
+		nameOffsets.append(nameOffsets[-1] + len(name))
+	order = array('i',sorted(range(len(nodes)),key=lambda i: nodes[i].name.lower()))
+
+	sections = [
+		(b'NAMEOFS',-1,nameOffsets.tobytes()),
+		(b'NAMES',-1,b''.join(names)),
+		(b'ORDER',-1,order.tobytes())
+	]
+	count = 0
+	for rid in sorted(set(relations).union(participants)):
+		edges = relations.get(rid,[])
+		count += len(edges)
+		rows,offsets,targets,weights,ranks = _csr(edges)
+		inRows,inOffsets,sources,unused,unranked = _csr(sorted([(dst,src,0,0) for src,dst,w,k in edges]))
+		members = participants.get(rid,[])
+		for tag,arr in ((b'ROWS',rows),(b'OFFSETS',offsets),(b'TARGETS',targets),(b'WEIGHTS',weights),(b'RANKS',ranks),(b'INROWS',inRows),(b'INOFS',inOffsets),(b'SOURCES',sources),(b'PARTS',array('i',[m[0] for m in members])),(b'PARTW',array('q',[m[1] for m in members]))):
+			sections.append((tag,rid,arr.tobytes()))
+
+	with open(path,'wb') as f:
+		f.write(HEADER.pack(MAGIC,VERSION,0 if sys.byteorder == 'little' else 1,len(sections),len(nodes)))
+		offset = HEADER.size + ENTRY.size * len(sections)
+		contents = []
+		for tag,rid,data in sections:
+			offset += -offset % 8
+			contents.append(ENTRY.pack(tag,rid,offset,len(data)))
+			offset += len(data)
+		f.write(b''.join(contents))
+		for tag,rid,data in sections:
+			f.write(b'\0' * (-f.tell() % 8))
+			f.write(data)
+	return {'nodes': len(nodes),'edges': count}
+
+
+class SnapshotNodes(object):
+
+	"""
+	Stands in for the `nodes` list of a SnapshotRegistry. The Nodes of the
+	snapshot are only created when they are first accessed; nodes added
+	after opening it are kept in `added`.
+	"""
+
+	def __init__(self,snapshot):
+		super(SnapshotNodes, self).__init__()
+		self.snapshot = snapshot
+		self.count = snapshot.count
+		self.cache = {}
+		self.added = []
+
+	def __len__(self):
+		return self.count + len(self.added)
+
+	def __getitem__(self,i):
+		if i < 0:
+			i += len(self)
+			if i < 0:
+				raise IndexError(i)
+		if i >= self.count:
+			return self.added[i - self.count]
+		node = self.cache.get(i)
+		if node is None:
+			node = self.cache[i] = Node(self.snapshot.name(i),None)
+			node.id = i
+			node.loaded = True
+		return node
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def append(self,node):
+		self.added.append(node)
+
+
+class SnapshotLookup(object):
+
+	"""
+	Stands in for the `lookup` dict (lowercased name -> Node) of a
+	SnapshotRegistry, finding the nodes of the snapshot by binary search of
+	its ID index
+	"""
+
+	def __init__(self,snapshot,nodes):
+		super(SnapshotLookup, self).__init__()
+		self.snapshot = snapshot
+		self.nodes = nodes
+		self.added = {}
+
+	def get(self,name,default=None):
+		node = self.added.get(name)
+		if node is None:
+			i = self.snapshot.find(name)
+			return default if i < 0 else self.nodes[i]
+		return node
+
+	def __contains__(self,name):
+		return self.get(name) is not None
+
+	def __getitem__(self,name):
+		node = self.get(name)
+		if node is None:
+			raise KeyError(name)
+		return node
+
+	def __setitem__(self,name,node):
+		self.added[name] = node
+
+	def __len__(self):
+		return len(self.nodes)
+
+	def values(self):
+		return iter(self.nodes)
+
+
+class LazyIndex(object):
+
+	"""
+	Stands in for one of the reverse indices of a SnapshotRegistry (the
+	relation index or the incoming edge index), building the entry of each
+	key from the snapshot with `build` when it is first accessed. `keys`
+	returns all of the keys the snapshot may have entries for.
+	"""
+
+	def __init__(self,build,keys):
+		super(LazyIndex, self).__init__()
+		self.build = build
+		self.keys = keys
+		self.entries = {}
+
+	def get(self,key,default=None):
+		if key not in self.entries:
+			self.entries[key] = self.build(key)
+		out = self.entries[key]
+		return default if out is None else out
+
+	def __contains__(self,key):
+		return self.get(key) is not None
+
+	def __getitem__(self,key):
+		out = self.get(key)
+		if out is None:
+			raise KeyError(key)
+		return out
+
+	def __setitem__(self,key,value):
+		self.entries[key] = value
+
+	def items(self):
+
+		"""
+		Yields all of the entries, building the missing ones
+		"""
+
+		for k in self.keys():
+			self.get(k)
+		for k,v in list(self.entries.items()):
+			if v is not None:
+				yield (k,v)
+
+
+class Snapshot(object):
+
+	"""
+	A snapshot file opened with mmap. Sections are exposed as memoryviews
+	of the mapping, so nothing is read until it is used, and the pages of
+	the file are shared by all processes that open it. The mapping is
+	copy-on-write: changing a weight in place only copies the page it is
+	on, for this process.
+	"""
+
+	def __init__(self,path):
+		super(Snapshot, self).__init__()
+		with open(path,'rb') as f:
+			self.mmap = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_COPY)
+		self.view = memoryview(self.mmap)
+		magic,version,order,sections,self.count = HEADER.unpack_from(self.mmap,0)
+		if magic != MAGIC or version != VERSION:
+			raise Exception('Snapshot: {0} is not a Pylog snapshot (version {1})'.format(path,VERSION))
+		if order != (0 if sys.byteorder == 'little' else 1):
+			raise Exception('Snapshot: {0} was saved on a machine with a different byte order'.format(path))
+		self.sections = {}
+		for i in range(sections):
+			tag,rid,offset,length = ENTRY.unpack_from(self.mmap,HEADER.size + ENTRY.size * i)
+			self.sections[(tag.rstrip(b'\0'),rid)] = (offset,length)
+		self.nameOffsets = self.section(b'NAMEOFS','q')
+		self.names = self.section(b'NAMES')
+		self.order = self.section(b'ORDER','i')
+		self.relations = sorted(set([rid for tag,rid in self.sections if rid >= 0]))
+
+	def section(self,tag,typecode=None,rid=-1):
+		offset,length = self.sections[(tag,rid)]
+		out = self.view[offset:offset + length]
+		return out.cast(typecode) if typecode else out
+
+	def name(self,i):
+		return str(self.names[self.nameOffsets[i]:self.nameOffsets[i+1]],'utf-8')
+
+	def key(self,i):
+		return self.name(i).lower()
+
+	def _bisect(self,name):
+
+		"""
+		Private helper, returns the position in the ID index of the first node
+		whose lowercased name is not less than `name`
+		"""
+
+		lo = 0
+		hi = self.count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.key(self.order[mid]) < name:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	def find(self,name):
+
+		"""
+		Returns the ID of the node with the given lowercased `name`, or -1
+		"""
+
+		i = self._bisect(name)
+		if i < self.count and self.key(self.order[i]) == name:
+			return self.order[i]
+		return -1
+
+	def prefix(self,prefix,limit):
+
+		"""
+		Returns the first `limit` lowercased names starting with `prefix`, in
+		order
+		"""
+
+		out = []
+		i = self._bisect(prefix)
+		while i < self.count and len(out) < limit:
+			key = self.key(self.order[i])
+			if not key.startswith(prefix):
+				break
+			out.append(key)
+			i += 1
+		return out
+
+	def relation(self,rid):
+
+		"""
+		Returns a Relation whose arrays are views of the snapshot
+		"""
+
+		rel = Relation()
+		rel.rows = self.section(b'ROWS','i',rid)
+		rel.offsets = self.section(b'OFFSETS','q',rid)
+		rel.targets = self.section(b'TARGETS','i',rid)
+		rel.weights = self.section(b'WEIGHTS','q',rid)
+		rel.ranks = self.section(b'RANKS','i',rid) if (b'RANKS',rid) in self.sections else None
+		return rel
+
+
+class SnapshotRegistry(CompactRegistry):
+
+	"""
+	CompactRegistry backed by a snapshot file (see save()). Its nodes, ID
+	index, relations and reverse indices are all read from the file as
+	they are needed, so opening it takes no time whatever its size.
+
+	The graph may be changed as any other: added nodes and edges are kept
+	in memory, and are not written to the snapshot.
+	"""
+
+	def __init__(self,graph,settings,path):
+		super(SnapshotRegistry, self).__init__(graph,settings)
+		# Snapshots always hold the incoming edge index
+		self.settings.INDEX_INCOMING = True
+		self.snapshot = Snapshot(path)
+		self.nodes = SnapshotNodes(self.snapshot)
+		self.lookup = SnapshotLookup(self.snapshot,self.nodes)
+		self.relations = dict([(rid,self.snapshot.relation(rid)) for rid in self.snapshot.relations])
+		self.participants = LazyIndex(self._participants,lambda: [self.nodes[rid] for rid in self.snapshot.relations])
+		self.incoming = LazyIndex(self._incoming,lambda: self.nodes)
+		self.names = NameIndex(lambda: chain([self.snapshot.key(i) for i in range(self.snapshot.count)],self.lookup.added),self.names.mutex)
+
+	# Edges added after opening are indexed in `incoming` itself
+	_index = NodeRegistry._index
+
+	def _prefix(self,prefix,limit):
+
+		"""
+		Private helper for search(), searches the ID index of the snapshot
+		and the nodes added since it was opened
+		"""
+
+		added = sorted([k for k in self.lookup.added if k.startswith(prefix)])
+		return sorted(self.snapshot.prefix(prefix,limit) + added[:limit])[:limit]
+
+	def _participants(self,relation):
+
+		"""
+		Private helper, reads the participants of `relation` from the
+		snapshot
+		"""
+
+		rid = getattr(relation,'id',-1)
+		if (b'PARTS',rid) not in self.snapshot.sections:
+			return None
+		ids = self.snapshot.section(b'PARTS','i',rid)
+		counts = self.snapshot.section(b'PARTW','q',rid)
+		return dict([(self.nodes[ids[i]],counts[i]) for i in range(len(ids))])
+
+	def _incoming(self,node):
+
+		"""
+		Private helper, reads the sources of the incoming edges of `node`
+		from the snapshot, by relation
+		"""
+
+		out = {}
+		i = getattr(node,'id',-1)
+		if i < 0 or i >= self.snapshot.count:
+			return out
+		for rid in self.snapshot.relations:
+			rows = self.snapshot.section(b'INROWS','i',rid)
+			j = bisect_left(rows,i)
+			if j < len(rows) and rows[j] == i:
+				offsets = self.snapshot.section(b'INOFS','q',rid)
+				sources = self.snapshot.section(b'SOURCES','i',rid)
+				out[self.nodes[rid]] = set([self.nodes[s] for s in sources[offsets[j]:offsets[j+1]]])
+		return out
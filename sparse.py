@@ -0,0 +1,196 @@
+from nodes import *
+from common import *
+
+try:
+	import numpy
+	import scipy.sparse
+except ImportError:
+	numpy = None
+
+class SparseGraph(object):
+
+	"""
+	Snapshot of a registry's relationships as one sparse adjacency matrix
+	per relation, where entry (i,j) holds the weight of the edge from node i
+	to node j.
+
+	A chain of rel() calls is then a chain of sparse matrix products: the
+	frontier is a row vector of node weights that is multiplied through the
+	matrix of each hop, which multiplies and sums weights just like
+	NodeList.rel() does (as if ACCUMULATE_RELATIONSHIPS were True). Many
+	seeds can be evaluated at once by stacking their vectors into a matrix.
+
+	Matrices are SciPy CSR matrices when NumPy and SciPy are installed, and
+	{row: [(column, weight), ...]} dicts otherwise. The snapshot does not
+	follow later changes to the graph and does not load from the database;
+	call refresh() to rebuild it.
+	"""
+
+	def __init__(self,registry):
+		super(SparseGraph, self).__init__()
+		self.registry = registry
+		self.refresh()
+
+	def refresh(self):
+
+		"""
+		Rebuilds the matrices from the registry
+		"""
+
+		reg = self.registry
+
+		# Compacting the relations of a CompactRegistry writes to it
+		with reg.lock.write():
+			if hasattr(reg,'relations'):
+				self.nodes = list(reg.nodes)
+				self.ids = None
+			else:
+				self.nodes = list(reg.registry.keys())
+				self.ids = dict([(n,i) for i,n in enumerate(self.nodes)])
+
+			# Collect the edges of every relation as (rows, columns, weights)
+			edges = {}
+			if self.ids is None:
+				for rid,rel in reg.relations.items():
+					rel.compact()
+					rows = []
+					for i in range(len(rel.rows)):
+						rows += [rel.rows[i]] * (rel.offsets[i+1] - rel.offsets[i])
+					edges[self.nodes[rid]] = (rows,list(rel.targets),list(rel.weights))
+			else:
+				for node,info in reg.registry.items():
+					src = self.ids[node]
+					for relation,relatives in info.items():
+						if relation not in edges:
+							edges[relation] = ([],[],[])
+						e = edges[relation]
+						for r in relatives:
+							e[0].append(src)
+							e[1].append(self.ids[r.node])
+							e[2].append(r.weight)
+
+		size = len(self.nodes)
+		self.matrices = {}
+		for relation,e in edges.items():
+			if numpy is not None:
+				self.matrices[relation] = scipy.sparse.csr_matrix(
+					(numpy.array(e[2],dtype=numpy.int64),(numpy.array(e[0],dtype=numpy.int64),numpy.array(e[1],dtype=numpy.int64))),
+					shape=(size,size)
+				)
+			else:
+				m = {}
+				for i in range(len(e[0])):
+					if e[0][i] not in m:
+						m[e[0][i]] = []
+					m[e[0][i]].append((e[1][i],e[2][i]))
+				self.matrices[relation] = m
+		return self
+
+	def _id(self,node):
+		return node.id if self.ids is None else self.ids.get(node)
+
+	def _relations(self,name):
+
+		"""
+		Private helper, returns the relation Nodes referenced by `name`, or all
+		of them if no name is given
+		"""
+
+		if not name:
+			return list(self.matrices)
+		return [n.node for n in self.registry.get(name,load=0) if n.node in self.matrices]
+
+	def matrix(self,name=None):
+
+		"""
+		Returns the adjacency matrix of the relation(s) referenced by `name`
+		(a string or list of strings), summed, or of all relations if no name
+		is given. Rows and columns are indexed by position in `nodes`.
+		"""
+
+		relations = self._relations(name)
+		if numpy is not None:
+			size = len(self.nodes)
+			out = scipy.sparse.csr_matrix((size,size),dtype=numpy.int64)
+			for r in relations:
+				out = out + self.matrices[r]
+			return out
+		out = {}
+		for r in relations:
+			for src,row in self.matrices[r].items():
+				out[src] = out.get(src,[]) + row
+		return out
+
+	def chain(self,seeds,relations):
+
+		"""
+		Evaluates a chain of rel() calls starting at `seeds`.
+
+		`seeds` may be anything accepted by NodeList.append()
+		`relations` must be a list with an entry per hop: a relation name, a
+			list of names, or None for all relations
+
+		returns NodeList
+		"""
+
+		return self.chainMany([seeds],relations)[0]
+
+	def chainMany(self,seeds,relations):
+
+		"""
+		Evaluates the same chain of rel() calls for every entry in `seeds`
+		in one pass of sparse matrix products; see chain().
+
+		returns a list of NodeLists, one for each entry in `seeds`
+		"""
+
+		lists = []
+		for s in seeds:
+			if type(s) != NodeList:
+				s = NodeList(tuplate(s,registry=self.registry),self.registry)
+			lists.append(s)
+		hops = [self.matrix(name) for name in relations]
+
+		if numpy is not None:
+			rows,cols,data = [],[],[]
+			for i,s in enumerate(lists):
+				for n in s:
+					j = self._id(n.node)
+					if j is not None:
+						rows.append(i)
+						cols.append(j)
+						data.append(n.weight)
+			frontier = scipy.sparse.csr_matrix(
+				(numpy.array(data,dtype=numpy.int64),(numpy.array(rows,dtype=numpy.int64),numpy.array(cols,dtype=numpy.int64))),
+				shape=(len(lists),len(self.nodes))
+			)
+			for m in hops:
+				frontier = frontier @ m
+			frontier = frontier.tocsr()
+			frontier.sum_duplicates()
+			indptr = frontier.indptr.tolist()
+			indices = frontier.indices.tolist()
+			data = frontier.data.tolist()
+			out = []
+			for i in range(len(lists)):
+				out.append(NodeList.fromTuples([
+					NodeTuple(self.nodes[indices[k]],data[k])
+					for k in range(indptr[i],indptr[i+1]) if data[k]
+				],self.registry))
+			return out
+
+		out = []
+		for s in lists:
+			frontier = {}
+			for n in s:
+				j = self._id(n.node)
+				if j is not None:
+					frontier[j] = frontier.get(j,0) + n.weight
+			for m in hops:
+				nxt = {}
+				for src,w in frontier.items():
+					for dst,v in m.get(src,()):
+						nxt[dst] = nxt.get(dst,0) + w * v
+				frontier = nxt
+			out.append(NodeList.fromTuples([NodeTuple(self.nodes[j],w) for j,w in frontier.items() if w],self.registry))
+		return out
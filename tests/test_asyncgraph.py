@@ -0,0 +1,47 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asyncgraph import AsyncGraph
+from graph import *
+
+
+class AsyncGraphTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir,'graph.db')
+		g = Graph()
+		g.direct('alice',['bob','carl'],'friends')
+		g.connect(self.path)
+		g.dump()
+		g.registry.dbc.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_cancelled_waiter_does_not_cancel_shared_load(self):
+		async def run():
+			g = AsyncGraph()
+			g.connect(self.path)
+			try:
+				first = asyncio.ensure_future(g.get('alice'))
+				second = asyncio.ensure_future(g.get('alice'))
+				await asyncio.sleep(0)
+				first.cancel()
+				out = await second
+				self.assertTrue(first.cancelled())
+				self.assertTrue(out.isLoaded())
+				return out.names()
+			finally:
+				g.close()
+		self.assertEqual(asyncio.run(run()),['alice'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,55 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+
+
+class CompactTiesTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def lists(self,g):
+		return [g.get('n%d' % i).rel('r').tuples() for i in range(20)]
+
+	def check(self,accumulate):
+		random.seed(3)
+		edges = [('n%d' % random.randrange(20),'','r','n%d' % random.randrange(200),random.randint(1,2)) for i in range(2000)]
+		settings = NodeRegistrySettings()
+		settings.ACCUMULATE_RELATIONSHIPS = accumulate
+		g = Graph(settings)
+		g.relateMany(edges)
+		expected = self.lists(g)
+
+		settings.COMPACT_STORAGE = True
+		settings.COMPACT_DELTA_LIMIT = 300
+		g = Graph(settings)
+		g.relateMany(edges[:1000])
+		g.compact()
+		g.relateMany(edges[1000:])
+		self.assertEqual(self.lists(g),expected)
+		g.compact()
+		self.assertEqual(self.lists(g),expected)
+
+		path = os.path.join(self.dir,'graph.snap')
+		g.saveSnapshot(path)
+		self.assertEqual(self.lists(Graph.openSnapshot(path)),expected)
+
+	def test_ties_keep_insertion_order(self):
+		self.check(True)
+
+	def test_ties_keep_insertion_order_without_accumulation(self):
+		self.check(False)
+
+
+if __name__ == '__main__':
+	unittest.main()
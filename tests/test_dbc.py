@@ -0,0 +1,89 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+
+
+class ConnectionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir,'graph.db')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def graph(self,threadSafe=False):
+		settings = NodeRegistrySettings()
+		settings.THREAD_SAFE = threadSafe
+		g = Graph(settings)
+		g.connect(self.path)
+		return g
+
+	def inThread(self,target):
+		thread = threading.Thread(target=target)
+		thread.start()
+		thread.join()
+
+	def test_close_stops_tracking(self):
+		g = self.graph()
+		g.relate('alice','bob','','friends')
+		g.registry.dbc.close()
+		g.relate('alice','carol','','friends')
+		self.assertFalse(g.registry.dbc.isConnected())
+		self.assertEqual(g.registry.dbc.dirtyEdges,{})
+		self.assertEqual(g.registry.dbc.dirtyNodes,{})
+
+	def test_finished_threads_release_connections(self):
+		dbc = self.graph(True).registry.dbc
+		for i in range(5):
+			self.inThread(lambda: dbc.connection.execute('SELECT 1'))
+		self.assertLessEqual(len(dbc.pool),2)
+		self.inThread(lambda: dbc.connection)
+		self.assertLessEqual(len(dbc.pool),2)
+
+	def test_is_connected_opens_nothing(self):
+		dbc = self.graph(True).registry.dbc
+		pooled = len(dbc.pool)
+		out = []
+		self.inThread(lambda: out.append(dbc.isConnected()))
+		self.assertEqual(out,[True])
+		self.assertEqual(len(dbc.pool),pooled)
+
+
+class NameIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir,'graph.db')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_new_names_are_indexed_on_dump(self):
+		settings = NodeRegistrySettings()
+		settings.FUZZY_INDEX = True
+		g = Graph(settings)
+		g.connect(self.path)
+		g.relate('alice','bob','','friends')
+		g.dump()
+		g.add('albert')
+		g.dump()
+		c = g.registry.dbc.connection.cursor()
+		last = c.execute("SELECT LASTNODE FROM NGRAMSTATE").fetchall()
+		self.assertEqual(last,c.execute("SELECT MAX(ID) FROM NODES").fetchall())
+		h = Graph(settings)
+		h.connect(self.path)
+		self.assertIn('albert',h.search('albrt',3,fuzzy=True).names())
+		g.registry.dbc.close()
+		h.registry.dbc.close()
+
+
+if __name__ == '__main__':
+	unittest.main()
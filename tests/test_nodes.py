@@ -0,0 +1,39 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+
+
+class NodeListRankTest(unittest.TestCase):
+
+	def setUp(self):
+		random.seed(2)
+		self.g = Graph()
+		self.g.relate('hub',[('n%d' % i,random.randint(1,5)) for i in range(100)],None,'friends')
+
+	def fresh(self):
+		return self.g.get('hub').rel('friends')
+
+	def test_eq_matches_sorted_list(self):
+		expected = self.fresh().nodes
+		for index in (0,1,5,99):
+			self.assertIs(self.fresh().eq(index),expected[index].node)
+		self.assertIsNone(self.fresh().eq(100))
+
+	def test_eq_negative(self):
+		expected = self.fresh().nodes
+		self.assertIs(self.fresh().eq(-1),expected[-1].node)
+		self.assertIs(self.fresh().eq(-100),expected[0].node)
+
+	def test_top(self):
+		expected = self.fresh().tuples()
+		self.assertEqual(self.fresh().top(3).tuples(),expected[:3])
+		self.assertEqual(self.fresh().top(-1).tuples(),expected[:-1])
+
+
+if __name__ == '__main__':
+	unittest.main()
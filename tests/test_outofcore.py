@@ -0,0 +1,99 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+
+def build(path):
+	random.seed(7)
+	g = Graph()
+	names = ['n%d' % i for i in range(200)]
+	for name in names:
+		g.direct(name,[(t,random.randint(1,3)) for t in random.sample(names,random.randint(2,12))],'friends')
+		g.direct(name,random.sample(names,2),'likes')
+	g.direct('hub',names[:80],'friends')
+	g.connect(path)
+	g.dump()
+	g.registry.dbc.close()
+	return names + ['hub']
+
+
+class OutOfCoreTest(unittest.TestCase):
+
+	LIMIT = 20
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir,'graph.db')
+		self.names = build(self.path)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def graphs(self,depth=0,compact=False):
+		settings = NodeRegistrySettings()
+		settings.COMPACT_STORAGE = compact
+		settings.LOAD_DEPTH = depth
+		ref = Graph(settings)
+		ref.connect(self.path)
+		settings = settings.copy()
+		settings.MAX_LOADED_NODES = self.LIMIT
+		ooc = Graph(settings)
+		ooc.connect(self.path)
+		return ref,ooc
+
+	def check(self,depth=0,compact=False):
+		ref,ooc = self.graphs(depth,compact)
+		random.seed(depth)
+		for i in range(60):
+			name = 'hub' if i % 10 == 0 else random.choice(self.names)
+			relation = [None,'friends','likes'][i % 3]
+			expected = sorted(ref.get(name).rel(relation).rel(relation).tuples())
+			actual = sorted(ooc.get(name).rel(relation).rel(relation).tuples())
+			self.assertEqual(actual,expected)
+			self.assertLessEqual(len(ooc.registry.resident),self.LIMIT)
+		ref.registry.dbc.close()
+		ooc.registry.dbc.close()
+
+	def test_rel_matches_in_memory(self):
+		self.check()
+
+	def test_rel_matches_in_memory_with_load_depth(self):
+		self.check(depth=1)
+
+	def test_rel_matches_in_memory_compact(self):
+		self.check(compact=True)
+
+	def test_held_list_is_reloaded(self):
+		ref,ooc = self.graphs()
+		held = ooc.get('hub').rel('friends')
+		for name in self.names[100:160]:
+			ooc.get(name).rel()
+		self.assertEqual(sorted(held.rel('friends').tuples()),sorted(ref.get('hub').rel('friends').rel('friends').tuples()))
+		self.assertLessEqual(len(ooc.registry.resident),self.LIMIT)
+		ref.registry.dbc.close()
+		ooc.registry.dbc.close()
+
+	def test_rel_without_load_stays_in_memory(self):
+		ref,ooc = self.graphs()
+		loaded = ooc.get('hub')
+		self.assertEqual(sorted(loaded.rel('friends',load=0).tuples()),sorted(ref.get('hub').rel('friends').tuples()))
+		for name in self.names[100:160]:
+			ooc.get(name)
+		self.assertFalse(loaded.first().loaded)
+		calls = []
+		ooc.registry.dbc.load = lambda *args,**kwargs: calls.append(args)
+		ooc.registry.evict = lambda *args,**kwargs: calls.append(args)
+		loaded.rel('friends',load=0)
+		self.assertEqual(calls,[])
+		ref.registry.dbc.close()
+		ooc.registry.dbc.close()
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+
+
+class PathTest(unittest.TestCase):
+
+	def graph(self,incoming,compact=False):
+		settings = NodeRegistrySettings()
+		settings.INDEX_INCOMING = incoming
+		settings.COMPACT_STORAGE = compact
+		g = Graph(settings)
+		g.relate('a','c',None,'next')
+		g.relate('c','b',None,'next')
+		return g
+
+	def test_bidirectional_matches_unidirectional(self):
+		for compact in (False,True):
+			g = self.graph(True,compact)
+			self.assertEqual(g.path('a','b','next').names(),['a','c','b'])
+			self.assertEqual(g.path('a','b','next',bidirectional=True).names(),['a','c','b'])
+			self.assertEqual(g.get('b').relatedBy('next').names(),['c'])
+
+	def test_bidirectional_requires_incoming_index(self):
+		g = self.graph(False)
+		self.assertEqual(g.path('a','b','next').names(),['a','c','b'])
+		with self.assertRaises(Exception):
+			g.path('a','b','next',bidirectional=True)
+		with self.assertRaises(Exception):
+			g.get('b').relatedBy('next')
+
+
+if __name__ == '__main__':
+	unittest.main()
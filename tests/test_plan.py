@@ -0,0 +1,50 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+
+
+class LazyPlanTest(unittest.TestCase):
+
+	def graph(self,accumulate):
+		settings = NodeRegistrySettings()
+		settings.ACCUMULATE_RELATIONSHIPS = accumulate
+		g = Graph(settings)
+		random.seed(11)
+		names = ['n%d' % i for i in range(120)]
+		for i in range(1500):
+			g.relate((random.choice(names),random.randint(1,4)),(random.choice(names),random.randint(1,4)),random.choice(['friends','likes']),random.choice(['friends','likes','']))
+		return g,names
+
+	def check(self,accumulate):
+		g,names = self.graph(accumulate)
+		random.seed(5)
+		for i in range(200):
+			seeds = random.sample(names,3)
+			relations = [random.choice([None,'friends','likes']) for j in range(random.randint(1,3))]
+			exclude = random.sample(names,10)
+			eager = g.get(seeds)
+			lazy = g.get(seeds).lazy()
+			for relation in relations:
+				eager = eager.rel(relation)
+				lazy = lazy.rel(relation)
+			eager = eager.exclude(exclude)
+			lazy = lazy.exclude(exclude)
+			self.assertEqual(lazy.run().tuples(),eager.tuples())
+
+			# Ties are broken the same way
+			self.assertEqual(lazy.top(5).run().tuples(),eager.top(5).tuples())
+
+	def test_lazy_matches_eager(self):
+		self.check(True)
+
+	def test_lazy_matches_eager_without_accumulation(self):
+		self.check(False)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+from ranking import PageRank
+
+LEAVES = 5000
+
+
+class RankingTest(unittest.TestCase):
+
+	def graph(self,compact=False,maxDegree=None):
+		settings = NodeRegistrySettings()
+		settings.COMPACT_STORAGE = compact
+		if maxDegree is not None:
+			settings.RANK_MAX_DEGREE = maxDegree
+		g = Graph(settings)
+		g.relate('seed','hub',None,'links')
+		g.relateMany([('hub','','links','leaf%d' % i,i + 1) for i in range(LEAVES)])
+		return g
+
+	def check(self,g,maxDegree):
+		hub = g.get('hub').first()
+		ranker = PageRank(g.registry,'links')
+		scores = ranker.power({g.get('seed').first(): 1})
+		relatives = ranker.edges[hub][0]
+		self.assertEqual(len(relatives),maxDegree)
+		self.assertEqual(sorted([n.name for n in relatives]),sorted(['leaf%d' % i for i in range(LEAVES - maxDegree,LEAVES)]))
+		self.assertLessEqual(len(scores),2 + maxDegree)
+
+	def test_hub_is_capped_by_default(self):
+		g = self.graph()
+		self.assertTrue(0 < g.registry.settings.RANK_MAX_DEGREE < LEAVES)
+		self.check(g,g.registry.settings.RANK_MAX_DEGREE)
+
+	def test_hub_is_capped_by_setting(self):
+		self.check(self.graph(maxDegree=50),50)
+
+	def test_hub_is_capped_with_compact_storage(self):
+		self.check(self.graph(True,50),50)
+
+	def test_recommend_from_hub(self):
+		out = self.graph(maxDegree=20).get('seed').recommend('links',top=5)
+		self.assertEqual(out.names(),['hub'] + ['leaf%d' % i for i in range(LEAVES - 1,LEAVES - 5,-1)])
+
+	def test_uncapped(self):
+		g = self.graph(maxDegree=0)
+		hub = g.get('hub').first()
+		ranker = PageRank(g.registry,'links')
+		ranker.power({g.get('seed').first(): 1})
+		self.assertEqual(len(ranker.edges[hub][0]),LEAVES)
+
+
+if __name__ == '__main__':
+	unittest.main()
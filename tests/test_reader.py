@@ -0,0 +1,52 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import *
+from reader import ReaderError
+
+
+class ReaderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir,'graph.txt')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def write(self,lines):
+		with open(self.path,'w') as f:
+			f.write('\n'.join(lines) + '\n')
+
+	def test_lines_before_an_error_are_committed(self):
+		self.write(['rel `alice` =friends> `bob`','rel `alice` =friends> `carol`','bogus'])
+		g = Graph()
+		with self.assertRaises(ReaderError) as raised:
+			g.read(self.path)
+		self.assertEqual(raised.exception.line,3)
+		self.assertEqual(g.get('alice').rel('friends').tuples(),[('bob',1),('carol',1)])
+
+	def test_failed_batch_is_not_committed_twice(self):
+		self.write(['rel `alice` =friends> `bob`'] * 4)
+		g = Graph()
+		g.registry.reader.batchSize = 2
+		relateBatch = g.registry.relateBatch
+		calls = []
+		def failing(batch):
+			calls.append(len(batch))
+			relateBatch(batch)
+			if len(calls) == 2:
+				raise ValueError('interrupted')
+		g.registry.relateBatch = failing
+		with self.assertRaises(ValueError):
+			g.read(self.path)
+		self.assertEqual(g.get('alice').rel('friends').tuples(),[('bob',4)])
+
+
+if __name__ == '__main__':
+	unittest.main()